@@ -0,0 +1,377 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Benchmarks
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Times the controller's scheduling hot paths and relay actuation. Runs against GPIO Zero's mock pins, so you
+#    can run it anywhere, not just on a Raspberry Pi. Save a baseline on your hardware with --save-baseline, after
+#    that every run is compared against it and the script fails (exit code 1) if anything got slower by more than
+#    the threshold. Timings on a busy computer jump around, so each benchmark is timed against a fixed bit of plain
+#    Python (the reference) in the same moment, the median of several rounds is what counts, and anything that
+#    looks slower gets another couple of chances before it counts as a regression.
+#
+#    Usage: python benchmark.py [--save-baseline] [--baseline file] [--threshold 0.25]
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+# use mock pins, so we don't need real hardware
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+
+import clock
+import controller
+import minutes
+import log
+import relay
+import scheduler
+import shared_state
+import shm_reader
+import simulate
+
+# where the baseline results are kept
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# how much slower (0.25 = 25%) a benchmark can get before it counts as a regression
+THRESHOLD = 0.25
+
+# the number of relays and slots per relay used for the benchmarks
+NUM_RELAYS = 32
+NUM_SLOTS = 300
+# the GPIO pins used for the relay benchmarks (a Pi only has GPIO 2 through 27)
+RELAY_PINS = list(range(2, 26))
+# how many rounds each benchmark is timed for (see measure), the median is the one that counts
+ROUNDS = 15
+# how many times the startup is timed, the best time is the one that counts
+REPEAT = 5
+# how many more times all of the benchmarks are run, keeping each one's best result, when any of them
+# look slower than the baseline (a real slowdown shows up every time, a busy computer doesn't). The
+# baseline is the best of this many runs plus one too
+RETRIES = 2
+# the slots the process loop wakeups are counted with (the same as the example schedule)
+WAKEUP_SLOTS = [
+    controller.Slot(controller.SETTIME, 700, controller.SETTIME, 900, False),
+    controller.Slot(controller.SETTIME, 1700, controller.SETTIME, 2300, True),
+    controller.Slot(controller.SUNRISE, 15, controller.SUNSET, -10, True),
+]
+# the results that are compared as they are, not relative to the reference (see measure)
+UNSCALED = ["reference", "process_loop wakeups per hour", "startup until relays are safe (ms)"]
+# the benchmarks that get their own threshold instead of --threshold
+TOLERANCES = {
+    # it's a count, not a time, so any change at all is a change in how the process loop works
+    "process_loop wakeups per hour": 0.0,
+    # starts a new process, so whatever else the computer's doing gets in the way
+    "startup until relays are safe (ms)": 1.0,
+    # a single call takes well under a microsecond, so the call itself is most of what's timed
+    # and these jump around the most
+    "add_time_24": 0.5,
+    "parse_slot_time": 0.5,
+    "reader sequence": 0.5,
+}
+# the longest (in milliseconds) the controller can take from startup until its relays
+# are in a safe state
+STARTUP_BUDGET = 1500
+
+# measures the controller's startup: how long it takes to load and get the relays into a
+# safe state, and which of the heavy modules got loaded along the way
+STARTUP_SCRIPT = """
+import sys, time
+start = time.time()
+import clock
+import controller
+controller.init_hardware()
+controller.relay.set_all(False)
+elapsed = (time.time() - start) * 1000
+sys.stderr.write("%f %s" % (elapsed, ",".join(m for m in ("numpy", "requests", "pytz", "tzlocal") if m in sys.modules)))
+"""
+
+# the reference's time (in seconds) in each round of the current run, and how many times it's
+# called each round (worked out the first time it's needed)
+_reference_times = []
+_reference_calls = None
+
+
+class Quiet(object):
+    # swallows the controller's output while a benchmark runs
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+
+    def __exit__(self, *args):
+        log.flush()
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def reference():
+    # a fixed bit of plain Python that every benchmark is timed against (see measure)
+    result = 0
+    for value in range(1000):
+        result += value & 7
+    return result
+
+
+def measure(func):
+    # returns the time a single call of func takes, relative to the reference (run_all turns it into
+    # microseconds). Each of the ROUNDS rounds times func and then the reference, back to back, so
+    # they both see the computer in the same state, and the median of the rounds counts: a computer
+    # that's busy (or throttled) all over doesn't change it, one function getting slower does. timeit's
+    # autorange picks the number of calls per round, so the quick ones get timed over thousands of calls
+    global _reference_calls
+
+    with Quiet():
+        timer = timeit.Timer(func)
+        reference_timer = timeit.Timer(reference)
+        if _reference_calls is None:
+            _reference_calls = max(reference_timer.autorange()[0] // 4, 1)
+        number = max(timer.autorange()[0] // 4, 1)
+        ratios = []
+        for i in range(ROUNDS):
+            elapsed = timer.timeit(number) / number
+            reference_elapsed = reference_timer.timeit(_reference_calls) / _reference_calls
+            _reference_times.append(reference_elapsed)
+            ratios.append(elapsed / reference_elapsed)
+        return statistics.median(ratios)
+
+
+def make_daily_slots(num_slots):
+    # returns a sorted list of random (possibly overlapping) on/off times
+    result = []
+    for i in range(num_slots):
+        on_time = random.randint(0, minutes.MINUTES_PER_DAY - 2)
+        off_time = random.randint(on_time + 1, minutes.MINUTES_PER_DAY - 1)
+        result.append([minutes.to_time_24(on_time), minutes.to_time_24(off_time)])
+    result.sort()
+    return result
+
+
+def make_slots(num_slots):
+    # returns a slots list with random set time windows, every other one random
+    rows = []
+    for i in range(num_slots):
+        on_time = random.randint(0, 2200)
+        rows.append(controller.Slot(controller.SETTIME, on_time - on_time % 100, controller.SETTIME, 2300, i % 2 == 0))
+    return rows
+
+
+def bench_schedule(results):
+    random.seed(1)
+    controller.seed_random(1)
+    channels = controller.channels
+    controller.channels = [(0, make_slots(NUM_SLOTS // 10)) for i in range(NUM_RELAYS)]
+    try:
+        results["build_daily_slots_array"] = measure(controller.build_daily_slots_array)
+        results["is_on_time"] = measure(lambda: controller.is_on_time(NUM_RELAYS - 1))
+        # what every pass through the process loop does when nothing's supposed to change
+        controller.scheduled[:] = [controller.is_on_time(channel) for channel in range(NUM_RELAYS)]
+        controller.built_on = clock.now().date()
+        results["reconcile (nothing changed)"] = measure(controller.reconcile)
+    finally:
+        controller.channels = channels
+    results["add_time_24"] = measure(lambda: minutes.add_time_24(1745, 30))
+    results["parse_slot_time"] = measure(lambda: controller.parse_slot_time(controller.SUNSET, -10))
+    rows = make_slots(NUM_SLOTS * 10)
+    results["parse_slot_times (%d slots)" % len(rows)] = measure(lambda: controller.parse_slot_times(rows))
+
+
+def bench_timelines(results):
+    random.seed(1)
+    all_slots = [make_daily_slots(NUM_SLOTS) for i in range(NUM_RELAYS)]
+    timelines = [controller.build_timeline(channel_slots) for channel_slots in all_slots]
+    lookups = [random.randint(0, minutes.MINUTES_PER_DAY - 1) for i in range(100)]
+
+    def lookup():
+        # one tick's worth of lookups (like is_on_time), for all of the relays
+        on = 0
+        for minute in lookups:
+            for timeline in timelines:
+                if timeline[minute] == 1:
+                    on += 1
+        return on
+
+    results["build_timeline (all relays)"] = measure(
+        lambda: [controller.build_timeline(channel_slots) for channel_slots in all_slots])
+    results["get_transitions (all relays)"] = measure(
+        lambda: [controller.get_transitions(timeline) for timeline in timelines])
+    results["timeline lookup (all relays)"] = measure(lookup) / len(lookups)
+
+
+def bench_relays(results):
+    with Quiet():
+        bank = relay.RelayBank(RELAY_PINS, min_on=0, min_off=0)
+    state = [False]
+
+    def apply_all():
+        state[0] = not state[0]
+        bank.apply(dict((channel, state[0]) for channel in range(len(bank))))
+
+    try:
+        results["set_status"] = measure(lambda: bank.set_status(0, not bank.status(0)))
+        results["set_status (no change)"] = measure(lambda: bank.set_status(0, bank.status(0)))
+        results["toggle"] = measure(lambda: bank.toggle(0))
+        results["apply (all relays changed)"] = measure(apply_all)
+        results["apply (nothing changed)"] = measure(lambda: bank.apply({0: bank.status(0)}))
+    finally:
+        bank.close()
+
+
+def bench_shared_state(results):
+    # publishing the controller's state (once per process loop pass, the schedule once a day),
+    # and reading it the way a dashboard would
+    random.seed(1)
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "state")
+    writer = shared_state.SharedState(path)
+    reader = shm_reader.Reader(path)
+    all_slots = [make_daily_slots(shm_reader.MAX_WINDOWS) for i in range(NUM_RELAYS)]
+    statuses = [i % 2 == 0 for i in range(NUM_RELAYS)]
+    try:
+        writer.write_schedule(datetime.now().date(), 645, 1830, RELAY_PINS[:NUM_RELAYS], all_slots)
+        results["write_status (all relays)"] = measure(
+            lambda: writer.write_status(statuses, statuses, statuses, 0.0))
+        results["write_schedule (all relays)"] = measure(
+            lambda: writer.write_schedule(datetime.now().date(), 645, 1830, RELAY_PINS[:NUM_RELAYS], all_slots))
+        results["reader sequence"] = measure(reader.sequence)
+        results["reader read_status"] = measure(reader.read_status)
+        results["reader read (all relays)"] = measure(reader.read)
+    finally:
+        reader.close()
+        writer.close()
+        shutil.rmtree(folder)
+
+
+def bench_wakeups(results):
+    # how many times an hour the process loop wakes up, over a simulated day (with WAKEUP_SLOTS,
+    # not whatever's in the schedule file)
+    wakeups = scheduler.wakeups
+    try:
+        with Quiet():
+            simulate.run(1, datetime(2026, 6, 1), seed=1, channels=[(controller.RELAY_PIN, WAKEUP_SLOTS)])
+    finally:
+        # let go of the simulated controller's pins, so the benchmarks can run again
+        relay.bank.close()
+        relay.bank = None
+        controller.btn.close()
+        controller.btn = None
+    results["process_loop wakeups per hour"] = (scheduler.wakeups - wakeups) / 24.0
+
+
+def bench_startup(results):
+    # start the controller in a new process (the best of a few tries), it shouldn't load any of the
+    # heavy modules before the relays are safe
+    env = dict(os.environ, GPIOZERO_PIN_FACTORY="mock")
+    times = []
+    for i in range(REPEAT):
+        process = subprocess.Popen([sys.executable, "-c", STARTUP_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output = process.communicate()[1].decode().strip().split(" ")
+        times.append(float(output[0]))
+        if len(output) > 1:
+            print("Startup loaded:", output[1])
+    results["startup until relays are safe (ms)"] = min(times)
+
+
+def run_all():
+    # runs all of the benchmarks, returns the results
+    del _reference_times[:]
+    results = {}
+    bench_startup(results)
+    bench_schedule(results)
+    bench_timelines(results)
+    bench_relays(results)
+    bench_shared_state(results)
+    bench_wakeups(results)
+    # turn the relative times into microseconds, going by the reference's median time in this run
+    results["reference"] = statistics.median(_reference_times) * 1000000
+    for name in results:
+        if name not in UNSCALED:
+            results[name] *= results["reference"]
+    return results
+
+
+def keep_best(results, more_results):
+    # keep the best (lowest) of each benchmark's results (comparing the times relative to each
+    # run's reference)
+    for name, value in more_results.items():
+        if name != "reference":
+            if name not in UNSCALED:
+                value = value / more_results["reference"] * results["reference"]
+            results[name] = min(results.get(name, value), value)
+
+
+def compare(results, baseline, threshold, show=True):
+    # returns the list of benchmarks that are slower than the baseline by more than the threshold
+    # (or their own, from TOLERANCES). Times are compared relative to the reference
+    scale = 1.0
+    if baseline.get("reference"):
+        scale = results["reference"] / baseline["reference"]
+    regressions = []
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if base and name != "reference":
+            change = (value / (1.0 if name in UNSCALED else scale) - base) / base
+            if show:
+                print("%-40s %12.3f %12.3f %+8.1f%%" % (name, value, base, change * 100))
+            if change > TOLERANCES.get(name, threshold):
+                regressions.append(name)
+        elif show:
+            print("%-40s %12.3f %12s" % (name, value, "-"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the relay controller")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown (0.25 = 25%%)")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET,
+                        help="longest allowed startup (in milliseconds)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    results = run_all()
+    for i in range(RETRIES):
+        if not args.save_baseline and not compare(results, baseline, args.threshold, show=False):
+            break
+        print("Running the benchmarks again (%d of %d)" % (i + 1, RETRIES))
+        keep_best(results, run_all())
+    print("\nReference: %.3f us (%.3f us in the baseline), the times below are relative to it" % (
+        results["reference"], baseline.get("reference", results["reference"])))
+    print("\n%-40s %12s %12s %9s" % ("Benchmark (us, or count)", "Result", "Baseline", "Change"))
+    regressions = compare(results, baseline, args.threshold)
+    if results["startup until relays are safe (ms)"] > args.startup_budget:
+        print("\nStartup took longer than the %d ms budget" % args.startup_budget)
+        regressions.append("startup until relays are safe (ms)")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print("\nBaseline saved to", args.baseline)
+    elif regressions:
+        print("\nREGRESSIONS (more than %d%% slower):" % (args.threshold * 100))
+        for name in regressions:
+            print("  " + name)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nExiting application\n")
+        sys.exit(0)
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Clock
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    The clock functions used by the controller. Everything that needs to know what time it is asks this module
+#    rather than calling datetime.now() directly, that way a virtual clock can be swapped in to simulate the
+#    controller without having to wait around in real time.
+# ********************************************************************************************************************
+
+import time
+from datetime import datetime, timedelta, timezone
+
+utc = timezone.utc
+
+# the functions used to read the wall clock (local time and UTC) and the monotonic clock
+_now = datetime.now
+_monotonic = time.monotonic
+_utcnow = None
+# the local timezone, None means the system's (see tz_table.py)
+_zone = None
+
+
+def now():
+    # returns the current local (wall clock) time
+    return _now()
+
+
+def utcnow():
+    # returns the current (aware) UTC time, this one doesn't jump when daylight saving time changes
+    if _utcnow is None:
+        return datetime.now(utc)
+    return _utcnow()
+
+
+def zone():
+    # returns the local timezone (a tzinfo object) the clock uses, or None for the system's
+    return _zone
+
+
+def monotonic():
+    # returns the current value of the monotonic clock (in seconds), this one never jumps
+    return _monotonic()
+
+
+def set_clock(now_func, monotonic_func, utcnow_func=None, zone=None):
+    # replace the clock functions, used by simulations to run on a virtual clock
+    global _now
+    global _monotonic
+    global _utcnow
+    global _zone
+
+    _now = now_func
+    _monotonic = monotonic_func
+    _utcnow = utcnow_func
+    _zone = zone
+
+
+def reset_clock():
+    # go back to using the system clock
+    set_clock(datetime.now, time.monotonic)
+
+
+class VirtualClock(object):
+    # A clock that only moves when you tell it to. Time is kept as seconds on a monotonic
+    # timeline, plus an offset used to turn it into a wall clock time. Changing the offset
+    # simulates the wall clock jumping (an NTP sync, for example) while the monotonic clock
+    # keeps going. Give it a timezone (a tzinfo object) and the wall clock follows that
+    # timezone's daylight saving time changes, just like the real one does. Without one,
+    # local time is UTC.
+
+    def __init__(self, start, zone=None):
+        # start is the (wall clock) datetime the clock starts at
+        self.start = start
+        self.zone = zone
+        if zone is not None:
+            self.start = start.replace(tzinfo=zone).astimezone(utc)
+        self.elapsed = 0.0
+        self.offset = 0.0
+
+    def now(self):
+        now = self.start + timedelta(seconds=self.elapsed + self.offset)
+        if self.zone is not None:
+            # convert to the (naive) local time
+            now = now.astimezone(self.zone).replace(tzinfo=None)
+        return now
+
+    def utcnow(self):
+        now = self.start + timedelta(seconds=self.elapsed + self.offset)
+        if self.zone is None:
+            return now.replace(tzinfo=utc)
+        return now
+
+    def seconds_at(self, local_time):
+        # returns the monotonic clock value at (naive) local_time, ignoring any jumps
+        if self.zone is not None:
+            return (local_time.replace(tzinfo=self.zone).astimezone(utc) - self.start).total_seconds()
+        return (local_time - self.start).total_seconds()
+
+    def monotonic(self):
+        return self.elapsed
+
+    def advance(self, seconds):
+        # move both clocks forward
+        self.elapsed += seconds
+
+    def jump(self, seconds):
+        # move only the wall clock (forward or backward)
+        self.offset += seconds
+
+    def install(self):
+        # make this the clock used by the application
+        set_clock(self.now, self.monotonic, self.utcnow, self.zone or utc)
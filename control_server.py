@@ -0,0 +1,293 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Control Server
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Lets other programs (a home automation hub, for example) check on and control a running controller. The
+#    server runs on its own thread (using asyncio, so it can handle lots of clients at once) and listens on a
+#    local TCP port or a Unix socket. Clients send one JSON request per line and get one JSON response per line:
+#
+#        {"cmd": "status"}
+#        {"cmd": "on", "relay": 0}                        (also "off" and "toggle")
+#        {"cmd": "override", "relay": 0, "on": true, "minutes": 30}
+#        {"cmd": "resume"}                                 (put the relays back on their schedule)
+#        {"cmd": "schedule"}
+#
+#    The server doesn't touch the relays itself, it hands each request to a handler function (the controller
+#    passes them to its process loop) and sends back whatever the handler replies with.
+#
+#    Run this file directly to put a running controller under load:
+#
+#        python control_server.py --clients 50 --requests 100
+#
+#    or add --check to start a controller of its own (on mock pins, so it runs anywhere), put it under load, and
+#    check that every request gets the right response and the controller keeps going.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import log
+
+# how long (in seconds) to wait for the handler to reply to a request
+REPLY_TIMEOUT = 5
+# the longest request line the server accepts
+MAX_LINE = 4096
+
+# the requests --check sends (over and over, from every client), every one of them should work
+CHECK_REQUESTS = [
+    {"cmd": "status"},
+    {"cmd": "schedule"},
+    {"cmd": "toggle", "relay": 1},
+    {"cmd": "on", "relay": 0},
+    {"cmd": "off", "relay": 0},
+    {"cmd": "override", "relay": 1, "on": False, "minutes": 5},
+    {"cmd": "resume"},
+]
+# the requests --check sends that should get an error (and not stop anything)
+CHECK_BAD_REQUESTS = [
+    b'{"cmd": "override", "relay": 0, "on": "false"}\n',
+    b'{"cmd": "override", "relay": 0, "minutes": 1e400}\n',
+    b'{"cmd": "override", "relay": 0, "minutes": -5}\n',
+    b'{"cmd": "on", "relay": 7}\n',
+    b'{"cmd": "on", "relay": "one"}\n',
+    b'{"cmd": "dance"}\n',
+    b'[1, 2]\n',
+    b'not json\n',
+]
+
+# the server's event loop, and the thread it runs on
+_loop = None
+_thread = None
+
+
+async def _handle_client(reader, writer, handler):
+    loop = asyncio.get_running_loop()
+    try:
+        while 1:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line.decode("utf-8"))
+                if not isinstance(request, dict):
+                    raise ValueError("a request must be a JSON object")
+            except ValueError as e:
+                response = {"ok": False, "error": "Invalid request: %s" % e}
+            else:
+                # the handler replies from another thread, so hand the reply back to this one
+                future = loop.create_future()
+                handler(request, lambda reply: loop.call_soon_threadsafe(_set_result, future, reply))
+                try:
+                    response = await asyncio.wait_for(future, REPLY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    response = {"ok": False, "error": "Timed out waiting for the controller"}
+            writer.write(json.dumps(response, default=str).encode("utf-8") + b"\n")
+            await writer.drain()
+    except (ConnectionError, ValueError, asyncio.LimitOverrunError) as e:
+        log.debug("Control client disconnected", error=e)
+    finally:
+        writer.close()
+
+
+def _set_result(future, reply):
+    if not future.done():
+        future.set_result(reply)
+
+
+def start_server(handler, port=None, host="127.0.0.1", path=None):
+    # start serving requests on a background thread, on the Unix socket at path if there is
+    # one, otherwise on the TCP port. handler is called (from the server's thread) with each
+    # request and a reply function, it has to call reply (from any thread) with the response
+    global _loop
+    global _thread
+
+    if _loop is not None:
+        return
+    started = threading.Event()
+    errors = []
+
+    def client(reader, writer):
+        return _handle_client(reader, writer, handler)
+
+    async def serve():
+        if path:
+            server = await asyncio.start_unix_server(client, path, limit=MAX_LINE)
+        else:
+            server = await asyncio.start_server(client, host, port, limit=MAX_LINE)
+        return server
+
+    def run():
+        try:
+            server = _loop.run_until_complete(serve())
+        except (IOError, OSError) as e:
+            errors.append(e)
+            started.set()
+            return
+        started.set()
+        try:
+            _loop.run_forever()
+        finally:
+            server.close()
+            _loop.run_until_complete(server.wait_closed())
+            _loop.close()
+
+    _loop = asyncio.new_event_loop()
+    _thread = threading.Thread(target=run, name="control")
+    _thread.daemon = True
+    _thread.start()
+    started.wait()
+    if errors:
+        _loop = None
+        raise errors[0]
+    log.info("Serving control requests", address=path or "%s:%d" % (host, port))
+
+
+def stop_server():
+    global _loop
+
+    if _loop is not None:
+        _loop.call_soon_threadsafe(_loop.stop)
+        _thread.join()
+        _loop = None
+
+
+async def _load_client(args, latencies):
+    # one client, sending its requests one at a time
+    if args.socket:
+        reader, writer = await asyncio.open_unix_connection(args.socket)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+    request = json.dumps({"cmd": args.cmd}).encode("utf-8") + b"\n"
+    for i in range(args.requests):
+        started = time.perf_counter()
+        writer.write(request)
+        await writer.drain()
+        response = json.loads((await reader.readline()).decode("utf-8"))
+        latencies.append(time.perf_counter() - started)
+        if not response.get("ok"):
+            print("Request failed:", response)
+    writer.close()
+
+
+async def _load_test(args):
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*[_load_client(args, latencies) for i in range(args.clients)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print("%d requests from %d clients in %.2f seconds (%d per second)" % (
+        len(latencies), args.clients, elapsed, len(latencies) / elapsed))
+    for name, fraction in (("p50", 0.5), ("p99", 0.99), ("max", 1.0)):
+        index = min(int(len(latencies) * fraction), len(latencies) - 1)
+        print("%s: %.2f ms" % (name, latencies[index] * 1000))
+
+
+async def _check_client(port, requests, failures):
+    # one --check client: sends requests copies of CHECK_REQUESTS' requests and all of the bad ones,
+    # adds what went wrong to failures
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = [json.dumps(request).encode("utf-8") + b"\n" for request in CHECK_REQUESTS]
+    for i in range(requests + len(CHECK_BAD_REQUESTS)):
+        bad = i >= requests
+        line = CHECK_BAD_REQUESTS[i - requests] if bad else lines[i % len(lines)]
+        writer.write(line)
+        await writer.drain()
+        response = json.loads((await reader.readline()).decode("utf-8"))
+        if bad and (response.get("ok") is not False or not response.get("error")):
+            failures.append("%s should have failed, got %s" % (line.strip(), response))
+        elif not bad and not response.get("ok"):
+            failures.append("%s failed: %s" % (line.strip(), response))
+    writer.close()
+
+
+def check(clients=50, requests=40):
+    # start a controller (on mock pins, with a schedule of its own) and its control server on a free
+    # port, send it lots of requests from lots of clients at once (good ones and bad ones), and check
+    # they all get the right response and the process loop keeps going. Raises AssertionError if not
+    os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+    import controller
+    import relay
+    from slot import SETTIME, Slot
+
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    controller.SCHEDULE_FILE = None
+    controller.USE_SNAPSHOT = False
+    controller.CONTROL_PORT = port
+    controller.CONTROL_SOCKET = None
+    controller.channels = [(18, [Slot(SETTIME, 700, SETTIME, 1900)]), (23, [Slot(SETTIME, 1900, SETTIME, 700)])]
+    # the requests would fill the log with relay changes
+    log.LEVEL = log.WARNING
+    controller.init_hardware()
+    controller.init_app()
+    controller.start_control_server()
+    loop_thread = threading.Thread(target=controller.process_loop, name="process_loop")
+    loop_thread.daemon = True
+    loop_thread.start()
+
+    async def run():
+        failures = []
+        started = time.perf_counter()
+        await asyncio.gather(*[_check_client(port, requests, failures) for i in range(clients)])
+        elapsed = time.perf_counter() - started
+        # and the process loop still answers (and took the override)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for request in ({"cmd": "override", "relay": 0, "on": False, "minutes": 5}, {"cmd": "status"}):
+            writer.write(json.dumps(request).encode("utf-8") + b"\n")
+            await writer.drain()
+            response = json.loads((await reader.readline()).decode("utf-8"))
+        writer.close()
+        if not response.get("ok") or not response["relays"][0]["override_until"]:
+            failures.append("after the load, the override didn't take: %s" % response)
+        return failures, elapsed
+
+    try:
+        failures, elapsed = asyncio.run(run())
+    finally:
+        stop_server()
+        relay.set_all(False)
+        log.flush()
+    if not loop_thread.is_alive():
+        failures.append("the process loop stopped")
+    if failures:
+        raise AssertionError("Control server check failed:\n" + "\n".join(failures[:20]))
+    total = clients * (requests + len(CHECK_BAD_REQUESTS))
+    print("%d requests from %d clients in %.2f seconds (%d per second), every one got the right response" % (
+        total, clients, elapsed, total / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Put a running controller's control server under load")
+    parser.add_argument("--check", action="store_true",
+                        help="start a controller of its own (on mock pins), put it under load and check the responses")
+    parser.add_argument("--host", default="127.0.0.1", help="the controller's host")
+    parser.add_argument("--port", type=int, default=9111, help="the controller's control port")
+    parser.add_argument("--socket", help="the controller's Unix socket (instead of the port)")
+    parser.add_argument("--clients", type=int, default=50, help="number of clients")
+    parser.add_argument("--requests", type=int, default=100, help="requests per client")
+    parser.add_argument("--cmd", default="status", help="the (read only) command to send")
+    args = parser.parse_args()
+    if args.check:
+        check(args.clients, args.requests)
+        return
+    asyncio.run(_load_test(args))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nExiting application\n")
+        sys.exit(0)
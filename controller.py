@@ -8,24 +8,29 @@
 
 from __future__ import print_function
 
-import random
+import os
 import sys
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import gpiozero
-import numpy as np
-import pytz
-import requests
-import tzlocal
 
+import clock
+import log
+import metrics
+import minutes
+import profiler
 import relay
+import schedule_file
+import scheduler
+import snapshot
+import tz_table
+# the different time triggers used by the application (SETTIME, SUNRISE, SUNSET)
+from slot import SETTIME, SUNRISE, SUNSET, Slot
 
-# 'constants' that define the different time triggers used by the application
-# DO NOT MODIFY THESE, you'll mess up the app's logic
-SETTIME = -1
-SUNRISE = -2
-SUNSET = -3
+# The rest of the modules the application uses (NumPy, the timezone libraries and
+# the HTTP client) take a while to load on a small Pi, so they're only imported
+# when (and if) they're needed, after the relays are in a safe state
 
 # ============================================================================
 # User (that's you) adjustable variables
@@ -34,6 +39,11 @@ SUNSET = -3
 
 # set this variable to the button pin used in your implementation
 BUTTON_PIN = 19
+# how long (in seconds) the button has to stop bouncing before a push counts
+BUTTON_BOUNCE_TIME = 0.05
+# a push toggles the relay, holding the button down for this long (in seconds)
+# puts the relay back on its schedule
+BUTTON_HOLD_TIME = 2
 # set this variable to the GPIO pin the relay is connected to
 RELAY_PIN = 18
 
@@ -46,6 +56,34 @@ RELAY_PIN = 18
 LOC_LAT = "35.227085"
 LOC_LONG = "-80.843124"
 
+# where the sunrise and sunset times come from: "local" calculates them
+# on the Pi (no network needed), "api" gets them from sunrise-sunset.org
+SOLAR_SOURCE = "local"
+# when using the web service, how many days of solar data to keep on hand
+# (so the controller can keep running when the network's down)
+SOLAR_PREFETCH_DAYS = 30
+
+# the (local only) port the controller's metrics are served on, you can see
+# them at http://localhost:9110/metrics. Set it to None to turn this off
+METRICS_PORT = 9110
+
+# Other programs can check on and control the controller through the (local only)
+# control server, described in control_server.py. Set CONTROL_SOCKET to the path of a
+# Unix socket to use that instead of the port, set both to None to turn it off
+CONTROL_PORT = 9111
+CONTROL_SOCKET = None
+# the longest (in minutes) the control server can override a relay for
+MAX_OVERRIDE_MINUTES = 7 * 24 * 60
+
+# The controller writes its log in batches to save wear and tear on the SD
+# card (warnings and errors are written right away). Set LOG_FILE to write
+# the log to a file instead of the console, LOG_LEVEL to log.DEBUG to see
+# everything, and LOG_HEARTBEAT to True to log every time the controller
+# wakes up
+LOG_FILE = None
+LOG_LEVEL = log.INFO
+LOG_HEARTBEAT = False
+
 # default times for sunrise and sunset. If solar data is enabled, the
 # code will reach out every day at 12:01 and populate these values with
 # the correct values for the current day. If this fails for any reason,
@@ -54,24 +92,53 @@ LOC_LONG = "-80.843124"
 time_sunrise = 700
 time_sunset = 1900
 
-# Slots array defines time windows and behavior for the relay
-# format: [ OnTrigger, OnValue, OffTrigger, OffValue, doRandom]
-slots = np.array(
-    # ONLY modify the following array with your time settings
-    [
-        (SETTIME, 700, SETTIME, 900, False),
-        (SETTIME, 1700, SETTIME, 2300, True),
-        (SUNRISE, 15, SUNSET, -10, True)
-    ],
-    # leave the rest of this alone
-    dtype=[
-        ('onTrigger', np.dtype(int)),
-        ('onValue', np.dtype(int)),
-        ('offTrigger', np.dtype(int)),
-        ('offValue', np.dtype(int)),
-        ('doRandom', np.dtype(bool))
-    ]
-)
+# Slots list defines time windows and behavior for the relay
+# format: Slot(OnTrigger, OnValue, OffTrigger, OffValue, doRandom)
+slots = [
+    # ONLY modify the following list with your time settings
+    Slot(SETTIME, 700, SETTIME, 900, False),
+    Slot(SETTIME, 1700, SETTIME, 2300, True),
+    Slot(SUNRISE, 15, SUNSET, -10, True)
+]
+
+# Relay channels: the GPIO pin each relay is connected to, and the slots list that
+# defines its time windows. For a multi-channel relay board, add an entry for each
+# channel; give each one its own slots list (built just like the one above) or share
+# one between channels.
+channels = [
+    (RELAY_PIN, slots),
+]
+
+# The schedule can also come from a file (described in schedule_file.py, copy
+# schedule.example.json to schedule.json to get started). When the file exists, its
+# channels replace the ones above, and the controller picks up any changes to it
+# while it's running (no restart needed). Set it to None to only use the channels above
+SCHEDULE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schedule.json")
+
+# The controller saves the day's schedule (random on/off times included), so if it
+# restarts part way through the day it picks up the same schedule where it left off.
+# Set this to False to build a new schedule every time the controller starts
+USE_SNAPSHOT = True
+
+# The random slots' on/off times come from a random number generator. Set this to a
+# number to get the same random times every time the controller starts (handy for
+# testing), None picks different ones every time
+RANDOM_SEED = None
+
+# The controller publishes its state (the relays, today's schedule and a heartbeat) to
+# this memory mapped file, so dashboards and watchdog scripts can read it (with
+# shm_reader.py) whenever they like. Set it to None to turn it off
+SHARED_STATE_FILE = "/dev/shm/pi-relay-timer"
+
+# A pass through the process loop that finishes this many seconds after it was supposed
+# to wake up (because it woke up late, or something it did took too long) is logged and
+# counted as a stall. Any transitions it missed happen as soon as it catches up
+STALL_TIME = 30
+# Send the controller a SIGUSR1 signal (or start it with the RELAY_PROFILE environment
+# variable set) to profile it for a while, see profiler.py. These functions get timed
+PROFILE_FUNCTIONS = ["reconcile", "start_day", "build_daily_slots_array", "get_solar_times",
+                     "handle_command", "reload_schedule"]
+PROFILE_RELAY_FUNCTIONS = ["apply", "set_status", "toggle", "flush_pending", "set_all"]
 # ============================================================================
 
 # ============================================================================
@@ -88,187 +155,618 @@ slash_n = "\n"
 # slots use one of the solar options
 uses_solar_data = False
 
-# API for determining sunrise and sunset times: http://sunrise-sunset.org/api
-# Test URL to retrieve data for Charlotte, NC US
-# Usage: http://api.sunrise-sunset.org/json?lat=35.2271&lng=-80.8431&date=today
-SOLAR_API_URL = "http://api.sunrise-sunset.org/json"
-# Make sure you set the local Timezone on the Raspberry Pi for this to
-# work correctly
+# events posted to the scheduler's event queue when the button is pushed or held down
+EVENT_BUTTON = "button"
+EVENT_BUTTON_HOLD = "button_hold"
+# event posted when a (background) solar data request finishes
+EVENT_SOLAR_DATA = "solar_data"
+# event posted when the schedule file changes
+EVENT_RELOAD = "reload"
+# event posted for each control server request, its data is (request, reply function)
+EVENT_CONTROL = "control"
+
+# When SOLAR_SOURCE is "api", solar data comes from the web service
+# configured in solar_api.py. Make sure you set the local Timezone on
+# the Raspberry Pi for this to work correctly
 
 # initialize the daily slots array. It will be an empty object at start, but will
-# be populated every day with the current slots.
+# be populated every day with the current slots; one list of slots per channel.
 daily_slots = []
-
-# Initialize the btn object and connect it to the button pin
-btn = gpiozero.Button(BUTTON_PIN)
-# initialize the relay object
-relay.init(RELAY_PIN)
-# initialize the random number generator
-random.seed(a=None)
+# one list per channel of (slot, on/off times) pairs: the on/off times each slot
+# generated for today. When the schedule changes, slots that didn't change keep
+# their times (and their random windows)
+slot_windows = []
+# the number of minutes in a day
+MINUTES_PER_DAY = minutes.MINUTES_PER_DAY
+# the slots' times are worked out with NumPy (all at once) when there are at least this many
+# slots to build, it isn't worth loading NumPy for fewer than that
+BATCH_SIZE = 100
+# built along with daily_slots, one timeline per channel. A timeline is a bytearray
+# with an entry for every minute of the day (index 0 is midnight), 1 means the relay
+# is supposed to be on during that minute, 0 means it's supposed to be off
+timelines = []
+# the times (in 24 hour format) when any of the relays are supposed to change
+transition_times = []
+
+# the state (True for on) the schedule last put each relay in. Every pass through the process
+# loop compares these with where the schedule says the relays are supposed to be right now
+scheduled = []
+# the day (a date) the daily slots array was last built for
+built_on = None
+
+# relays the control server has overridden for a while, channel: when (datetime) the
+# override ends. The schedule leaves them alone until then
+overrides = {}
+
+# the button object, created by init_hardware
+btn = None
+# the shared state file, opened by start_shared_state, and the daily_slots list last written to it
+shared = None
+shared_slots = None
+# the schedule file watcher, created by watch_schedule
+watcher = None
+
+metrics.describe("scheduler_lateness_seconds", "How long after the planned time transitions actually ran")
+metrics.describe("loop_iteration_seconds", "Time spent handling each event in the process loop")
+metrics.describe("loop_stalls_total", "Number of times the process loop stalled past a time it was supposed to wake up")
+metrics.describe("loop_stall_seconds", "How long (past the time it was supposed to wake up) the process loop stalled")
+metrics.describe("button_presses_total", "Number of button pushes")
+metrics.describe("button_holds_total", "Number of times the button was held down")
+metrics.describe("control_requests_total", "Number of control server requests")
+metrics.describe("solar_fetch_seconds", "Time spent getting solar data")
+metrics.describe("solar_fetch_failures_total", "Number of times getting solar data failed")
+metrics.gauge("scheduler_wakeups", lambda: scheduler.wakeups, "Number of times the scheduler woke up")
+metrics.gauge("clock_jumps", lambda: scheduler.clock_jumps, "Number of wall clock jumps detected")
+metrics.gauge("relays_on", lambda: sum(relay.bank.statuses()) if relay.bank else 0, "Number of relays that are on")
+
+# the random number generator used for the random slots, created (using RANDOM_SEED)
+# the first time it's needed
+rng = None
+
+
+def init_hardware(pin_factory=None):
+    # connect to the button and relays. pin_factory lets you use something other than
+    # the Pi's GPIO pins (GPIO Zero's mock pins, for example)
+    global btn
+
+    # let go of the button if we already have it (so we can be initialized again)
+    if btn is not None:
+        btn.close()
+    # initialize the relay bank first, one relay per channel. The relays start
+    # out off, so this puts everything in a safe state as early as possible
+    relay.init_bank([channel[0] for channel in channels], pin_factory)
+    # Initialize the btn object and connect it to the button pin
+    btn = gpiozero.Button(BUTTON_PIN, bounce_time=BUTTON_BOUNCE_TIME, hold_time=BUTTON_HOLD_TIME,
+                          pin_factory=pin_factory)
+    # gpiozero calls these (from its own thread) on the button's edges, they
+    # just wake up the process loop, which does the actual work
+    btn.when_pressed = lambda: scheduler.post(EVENT_BUTTON)
+    btn.when_held = lambda: scheduler.post(EVENT_BUTTON_HOLD)
 
 
 def init_app():
     global uses_solar_data
+    global built_on
 
     # See if any of our slots require solar data (sunrise, sunset)
     # this drives the slot builder that runs every morning at 12:01 AM
     uses_solar_data = check_for_solar_events()
     if uses_solar_data:
-        print("\nSolar data enabled")
+        log.info("Solar data enabled")
         # do we have long and lat values?
         if LOC_LAT or LOC_LONG:
-            print("Lat and Long values exist")
+            log.debug("Lat and Long values exist")
         else:
             # then we can't run, and we need to terminate
-            print("\nINVALID CONFIGURATION: Lat or Long values missing")
+            log.error("INVALID CONFIGURATION: Lat or Long values missing")
             sys.exit(1)
+    # if the controller already built today's schedule (before a restart), use it
+    previous = load_snapshot()
+    if uses_solar_data and previous is None:
         get_solar_times()
 
     # build the daily slots array for today
-    build_daily_slots_array()
+    build_daily_slots_array(previous)
+    # (if it's before 12:01 AM, today's rebuild still has to run)
+    built_on = (clock.now() - timedelta(minutes=1)).date()
+    save_snapshot()
 
-    # are we supposed to be on?
-    if is_on_time():
-        # then turn the relay on
-        print("\nWhoops, we're supposed to be on!")
-        relay.set_status(True)
+    # are we supposed to be on? (the relays all start off)
+    scheduled[:] = [False] * len(channels)
+    for channel in range(len(channels)):
+        if is_on_time(channel):
+            log.info("Whoops, relay is supposed to be on!", relay=channel)
+    reconcile()
 
 
 def process_loop():
-    # initialize the lastMinute variable to the current time minus 1
-    # this subtraction isn't technically accurate, but for this purpose,
-    # just trying to understand if the minute changed, it's OK
-    last_time = inc_time(get_time_24(datetime.now()), -1)
-    # infinite loop to continuously check time values
+    # infinite loop that sleeps until the next time there's something to do
     while 1:
-        # Is the button pushed?
-        if btn.is_pressed:
-            print("Detected button push")
-            # Then toggle the relay
-            relay.toggle()
+        # figure out when the next transition (or slot rebuild) is, then sleep until
+        # then (or until the button is pushed)
+        next_time = scheduler.next_event_time(get_event_times(), clock.utcnow())
+        # if a relay change is waiting for the relay's minimum on/off time, wake up for that too
+        # (there's no next time if the schedule never changes the relays)
+        wake_time = next_time
+        deadline = relay.next_deadline()
+        if deadline is not None:
+            deadline_time = clock.utcnow() + timedelta(seconds=max(deadline - clock.monotonic(), 0))
+            wake_time = deadline_time if next_time is None else min(next_time, deadline_time)
+        event_type, data = scheduler.wait_until(wake_time)
+        started = time.perf_counter()
+        if LOG_HEARTBEAT:
+            log.info("Heartbeat", event=event_type)
+        if event_type == EVENT_BUTTON:
+            metrics.inc("button_presses_total")
+            log.info("Detected button push")
+            # Then toggle the relays
+            for channel in range(len(channels)):
+                relay.toggle(channel)
+        elif event_type == EVENT_BUTTON_HOLD:
+            metrics.inc("button_holds_total")
+            log.info("Detected button hold, resuming schedule")
+            overrides.clear()
+            resume_schedule()
+        elif event_type == EVENT_SOLAR_DATA:
+            # the solar data request finished, if it got today's data, rebuild the
+            # day's slots with the new sunrise and sunset times
+            import solar_cache
+            if set_solar_times(solar_cache.get(LOC_LAT, LOC_LONG, clock.now().date())):
+                build_daily_slots_array()
+                save_snapshot()
+        elif event_type == EVENT_RELOAD:
+            reload_schedule()
+        elif event_type == EVENT_CONTROL:
+            request, reply = data
+            # whatever's wrong with a request, the client gets an error and the process loop keeps going
+            try:
+                response = handle_command(request)
+            except Exception as e:
+                log.error("Unable to handle control request", request=request, error=repr(e))
+                response = {"ok": False, "error": "Unable to handle request: %r" % e}
+            reply(response)
+        elif event_type == scheduler.EVENT_TIMER and data == next_time:
+            # we made it to the next event time, so we have work to do
+            metrics.observe("scheduler_lateness_seconds", (clock.utcnow() - data).total_seconds())
+            log.debug("Processing time", time=get_time_24(tz_table.to_local(data)))
+        elif event_type == scheduler.EVENT_CLOCK_JUMP:
+            # the system time changed while we were asleep (NTP sync, DST change), so we
+            # may have skipped (or repeated) a transition. Make sure the relay is where it's
+            # supposed to be, the next pass through the loop re-plans from the new time
+            log.warning("Clock changed, re-planning", seconds=int(data))
+            resume_schedule()
+        # put the relays where the schedule says they're supposed to be right now, whatever
+        # woke us up. That includes any transitions we were supposed to wake up for while
+        # we were busy, so a stall makes them late instead of missing them
+        if wake_time is not None:
+            late = (clock.utcnow() - wake_time).total_seconds()
+            if late > STALL_TIME:
+                metrics.inc("loop_stalls_total")
+                metrics.observe("loop_stall_seconds", late)
+                log.warning("Process loop stalled, catching up", seconds=int(late), event=event_type)
+        reconcile()
+        # write any delayed relay changes that are due
+        relay.flush_pending()
+        publish_state()
+        metrics.observe("loop_iteration_seconds", time.perf_counter() - started)
+
+
+def resume_schedule():
+    # put the relays where the schedule says they're supposed to be right now (except
+    # the ones that are overridden)
+    changes = dict((channel, is_on_time(channel)) for channel in range(len(channels)) if channel not in overrides)
+    for channel, state in changes.items():
+        scheduled[channel] = state
+    relay.apply(changes)
+
+
+def start_metrics():
+    # start serving the metrics (if it's turned on). The controller runs fine without them, so
+    # if the port's taken (by another controller, or fleet.py), it just goes without
+    if METRICS_PORT:
+        try:
+            metrics.start_server(METRICS_PORT)
+        except (IOError, OSError) as e:
+            log.warning("Unable to serve metrics, running without them", port=METRICS_PORT, error=e)
+            return
+        # the recent log records (debug ones too) are at http://localhost:9110/log
+        metrics.add_page("/log", log.render_recent)
+
+
+def start_control_server():
+    # start the control server (if it's turned on), its requests are handled by the process loop.
+    # Like the metrics, if its port (or socket) can't be used, the controller runs without it
+    if CONTROL_SOCKET or CONTROL_PORT:
+        import control_server
+        try:
+            control_server.start_server(lambda request, reply: scheduler.post(EVENT_CONTROL, (request, reply)),
+                                        port=CONTROL_PORT, path=CONTROL_SOCKET)
+        except (IOError, OSError) as e:
+            log.warning("Unable to start the control server, running without it", address=CONTROL_SOCKET or
+                        CONTROL_PORT, error=e)
+
+
+def start_shared_state():
+    # open the shared state file (if it's turned on) and publish the current state to it
+    global shared
+
+    if SHARED_STATE_FILE and shared is None:
+        import shared_state
+        try:
+            shared = shared_state.SharedState(SHARED_STATE_FILE)
+        except (IOError, OSError) as e:
+            log.warning("Unable to open the shared state file, not publishing state", path=SHARED_STATE_FILE,
+                        error=e)
+            return
+        log.info("Publishing state", path=SHARED_STATE_FILE)
+        publish_state()
+        # the process loop can sleep for hours, keep the heartbeat going while it does (it's
+        # updated at least every scheduler.MAX_SLEEP seconds)
+        scheduler.set_tick(publish_state)
+
+
+def publish_state():
+    # update the shared state file: the relays' status every time, today's schedule when it's changed
+    # (build_daily_slots_array makes a new daily_slots list every time it runs)
+    global shared_slots
+
+    if shared is None:
+        return
+    if shared_slots is not daily_slots:
+        shared_slots = daily_slots
+        shared.write_schedule(clock.now().date(), time_sunrise, time_sunset, [channel[0] for channel in channels],
+                              daily_slots)
+    num_channels = len(channels)
+    shared.write_status([relay.status(channel) for channel in range(num_channels)],
+                        [is_on_time(channel) for channel in range(num_channels)],
+                        [channel in overrides for channel in range(num_channels)], clock.utcnow().timestamp())
+
+
+def handle_command(request):
+    # handle a control server request, returns the response
+    metrics.inc("control_requests_total")
+    command = request.get("cmd")
+    log.debug("Control request", request=request)
+    try:
+        if command == "status":
+            return get_status()
+        if command == "schedule":
+            return get_schedule()
+        if command == "resume":
+            overrides.clear()
+            resume_schedule()
+            return get_status()
+        # the rest of the commands work on a single relay
+        channel = int(request.get("relay", 0))
+        if not 0 <= channel < len(channels):
+            return {"ok": False, "error": "Unknown relay: %d" % channel}
+        if command == "on" or command == "off":
+            # like the button: the relay stays this way until its next scheduled change
+            overrides.pop(channel, None)
+            relay.set_status(command == "on", channel)
+        elif command == "toggle":
+            overrides.pop(channel, None)
+            relay.toggle(channel)
+        elif command == "override":
+            # the relay stays this way for a while (whatever its schedule says), then goes back to
+            # its schedule. The override ends at the start of a minute (when the process loop wakes up)
+            duration = float(request.get("minutes", 60))
+            if not 0 < duration <= MAX_OVERRIDE_MINUTES:
+                return {"ok": False, "error": "minutes must be more than 0 and at most %d" % MAX_OVERRIDE_MINUTES}
+            # (only a JSON true or false, so "false" doesn't turn the relay on)
+            turn_on = request.get("on", True)
+            if not isinstance(turn_on, bool):
+                return {"ok": False, "error": "on must be true or false"}
+            until = clock.now() + timedelta(minutes=duration)
+            if until.second or until.microsecond:
+                until = until.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            overrides[channel] = until
+            relay.set_status(turn_on, channel)
+            log.info("Relay overridden", relay=channel, until=until)
         else:
-            # otherwise...
-            # get the current time (in 24 hour format)
-            current_time = get_time_24(datetime.now())
-            # is the time the same as the last time we checked?
-            if current_time != last_time:
-                # No? OK, so the time changed and we may have work to do...
-                print(current_time)
-                # reset last_time to the current_time (so this doesn't happen until
-                # the next minute change
-                last_time = current_time
-                # build the daily slots array every day at 12:01 AM
-                # that's 1 (001) in 24 hour time
-                if current_time == 1:
-                    # if one of the solar times is enabled
-                    if uses_solar_data:
-                        # populate our sunrise and sunset values for the day
-                        get_solar_times()
-                        # build the list of on/off times for today
-                        build_daily_slots_array()
-                        # otherwise just use the static slots we already have
-
-                # finally, check to see if we're supposed to be turning the
-                # relay on or off
-                for slot in daily_slots:
-                    if current_time == slot[0]:
-                        relay.set_status(True)
-                    if current_time == slot[1]:
-                        relay.set_status(False)
-        # wait a little bit, then check again
-        time.sleep(.25)
-
-
-def validate_slots():
-    global slots
+            return {"ok": False, "error": "Unknown command: %s" % command}
+    except (TypeError, ValueError, OverflowError) as e:
+        return {"ok": False, "error": "Invalid request: %s" % e}
+    return get_status()
+
+
+def get_status():
+    # returns the relays' status for the control server
+    relays = []
+    for channel, (relay_pin, channel_slots) in enumerate(channels):
+        relays.append({
+            "relay": channel,
+            "pin": relay_pin,
+            "on": relay.status(channel),
+            "scheduled": is_on_time(channel),
+            "override_until": overrides[channel].isoformat() if channel in overrides else None,
+        })
+    # (there's no next event if the schedule never changes the relays)
+    next_time = scheduler.next_event_time(get_event_times(), clock.utcnow())
+    return {"ok": True, "time": clock.now().isoformat(),
+            "next_event": tz_table.to_local(next_time).isoformat() if next_time is not None else None,
+            "relays": relays}
+
+
+def get_schedule():
+    # returns today's schedule for the control server
+    result = []
+    for channel, (relay_pin, channel_slots) in enumerate(channels):
+        result.append({
+            "relay": channel,
+            "pin": relay_pin,
+            "slots": [list(slot.as_tuple()) for slot in channel_slots],
+            "daily_slots": daily_slots[channel],
+        })
+    return {"ok": True, "sunrise": time_sunrise, "sunset": time_sunset, "channels": result}
+
+
+def install_profiler():
+    # get ready to profile the controller when asked to (process_loop never returns, so it
+    # isn't timed; the profile has its loop_iteration_seconds and the samples of it instead)
+    this_module = sys.modules[__name__]
+    profiler.install([(this_module, name) for name in PROFILE_FUNCTIONS] +
+                     [(relay, name) for name in PROFILE_RELAY_FUNCTIONS])
+
+
+def load_schedule():
+    # use the schedule file's channels (if there is one) instead of the ones defined
+    # in this file. Raises ValueError if the file isn't formatted correctly
+    global channels
+
+    if SCHEDULE_FILE and os.path.exists(SCHEDULE_FILE):
+        channels = schedule_file.load(SCHEDULE_FILE)
+        log.info("Loaded schedule file", path=SCHEDULE_FILE, channels=len(channels))
+
+
+def watch_schedule():
+    # start watching the schedule file, changes to it wake up the process loop
+    global watcher
+
+    if SCHEDULE_FILE and watcher is None:
+        watcher = schedule_file.Watcher(SCHEDULE_FILE, lambda: scheduler.post(EVENT_RELOAD))
+
+
+def reload_schedule():
+    # the schedule file changed, load it and rebuild the slots that changed. The current
+    # schedule stays in place if there's anything wrong with the new one. Returns True
+    # if the new schedule was loaded
+    global channels
+    global uses_solar_data
+
+    try:
+        new_channels = schedule_file.load(SCHEDULE_FILE)
+    except (IOError, OSError, ValueError) as e:
+        log.error("Unable to load schedule file, keeping the current schedule", path=SCHEDULE_FILE, error=e)
+        return False
+    # the relays are connected when the controller starts, so they can't change now
+    if [channel[0] for channel in new_channels] != [channel[0] for channel in channels]:
+        log.error("Relay pins can't change while the controller is running, keeping the current schedule")
+        return False
+    if not validate_slots(new_channels):
+        log.error("Invalid slot(s) in schedule file, keeping the current schedule")
+        return False
+
+    log.info("Schedule file changed, rebuilding changed slots", path=SCHEDULE_FILE)
+    channels = new_channels
+    if check_for_solar_events() and not uses_solar_data:
+        # the schedule just started using solar data
+        uses_solar_data = True
+        get_solar_times()
+    uses_solar_data = check_for_solar_events()
+    build_daily_slots_array(slot_windows)
+    save_snapshot()
 
+    # only touch the relays that are supposed to be somewhere different right now
+    # under the new schedule (so a relay the button turned on stays that way)
+    reconcile()
+    return True
+
+
+def start_day():
+    # build the daily slots array for the day. It runs every day at 12:01 AM (or as soon
+    # after that as the process loop gets to it)
+    global built_on
+
+    built_on = clock.now().date()
+    # if one of the solar times is enabled
+    if uses_solar_data:
+        # populate our sunrise and sunset values for the day, then build
+        # the list of on/off times for today. When the solar data comes from
+        # the web service, the list gets rebuilt when the request finishes
+        if get_solar_times():
+            build_daily_slots_array()
+        # otherwise just use the static slots we already have
+    # save the day's schedule, so a restart today picks it up
+    save_snapshot()
+
+
+def reconcile():
+    # put the relays where the schedule says they're supposed to be right now. This compares
+    # each relay's timeline entry for the current minute with the state the schedule last put
+    # it in, rather than waiting for the minute its timeline changes, so a transition the
+    # process loop was too busy to wake up for still happens (late). A relay the button or the
+    # control server turned on or off stays that way until its schedule changes. The minute comes
+    # from the schedule's time, so the repeated hour when daylight saving time ends only runs once
+    now = clock.now()
+    minute = minutes.of_day(tz_table.schedule_time(clock.utcnow()))
+    # a new day, starting at 12:01 AM (that's 1 (001) in 24 hour time)
+    if built_on != now.date() and minute >= 1:
+        start_day()
+    # overrides that are over go back to their schedule
+    for channel, until in list(overrides.items()):
+        if until <= now:
+            del overrides[channel]
+            log.info("Override ended, resuming schedule", relay=channel)
+            scheduled[channel] = None
+    # collect the changes for every channel, then apply them in one batch
+    # (only the relays that aren't already where they're supposed to be get touched)
+    changes = {}
+    for channel, timeline in enumerate(timelines):
+        state = timeline[minute] == 1
+        if channel not in overrides and state != scheduled[channel]:
+            changes[channel] = scheduled[channel] = state
+    relay.apply(changes)
+
+
+def load_snapshot():
+    # returns the slot_windows saved today (and puts back the sunrise and sunset times
+    # they were built with), or None if there isn't a snapshot for today
+    global time_sunrise
+    global time_sunset
+
+    if not USE_SNAPSHOT:
+        return None
+    saved = snapshot.load(clock.now().date())
+    if saved is None:
+        return None
+    time_sunrise, time_sunset, previous = saved
+    log.info("Restored today's schedule from snapshot", sunrise=time_sunrise, sunset=time_sunset)
+    return previous
+
+
+def save_snapshot():
+    # save today's schedule
+    if USE_SNAPSHOT:
+        snapshot.save(clock.now().date(), time_sunrise, time_sunset, slot_windows)
+
+
+def get_event_times():
+    # returns the list of times (in 24 hour format) the process loop needs to wake up for
+    event_times = list(transition_times)
+    if uses_solar_data:
+        # the daily slots array gets rebuilt every day at 12:01 AM
+        event_times.append(1)
+    # and when any of the overrides end
+    event_times.extend(get_time_24(until) for until in overrides.values())
+    return event_times
+
+
+def validate_slots(channel_list=None):
     # initialize our error flag
     has_error = False
-    # Make sure our slots configuration is valid
-    for slot in np.nditer(slots):
-        if not validate_slot(slot):
-            print("we have an error")
-            has_error = True
+    # Make sure our slots configuration is valid (or the channel_list's, if there is one)
+    for relay_pin, channel_slots in channel_list or channels:
+        for slot in channel_slots:
+            if not validate_slot(slot):
+                log.error("Invalid slot", slot=slot)
+                has_error = True
     return not has_error
 
 
 def validate_slot(slot):
-    print("\nValidating slot:", slot)
-
-    # Does the slot use set times and off time is before on time?
-    if (slot['onTrigger'] == SETTIME) and (slot['offTrigger'] == SETTIME) and (slot['offTrigger'] < slot['onTrigger']):
-        print("Set time: Off time can't be before on time")
+    log.debug("Validating slot", slot=slot)
+
+    for trigger, value in ((slot.on_trigger, slot.on_value), (slot.off_trigger, slot.off_value)):
+        if trigger not in (SETTIME, SUNRISE, SUNSET):
+            log.error("Unknown trigger", slot=slot)
+            return False
+        # Is the set time a real time?
+        if trigger == SETTIME and not minutes.is_time_24(value):
+            log.error("Set time: Not a valid time (24 hour format)", slot=slot)
+            return False
+        # Is the solar data offset more than a day? (any other offset works, even one
+        # that goes past midnight)
+        if trigger != SETTIME and abs(value) >= MINUTES_PER_DAY:
+            log.error("Solar Data: Time offset must be less than a day", slot=slot)
+            return False
+
+    # Are the random on/off times possible?
+    if slot.do_random and not 1 <= slot.min_minutes <= slot.max_minutes:
+        log.error("Random: min_minutes must be at least 1, and no more than max_minutes", slot=slot)
         return False
 
-    # Is our solar data delta greater than an hour?
-    # this one isn't critical, but when you get into big numbers (multiple hours of time), then the time math
-    # gets wonky, so lets just cap it at 60 minutes?
-    if ((slot['onTrigger'] < SETTIME) and (slot['onValue'] > 60)) or (
-            (slot['offTrigger'] < SETTIME) and (slot['offValue'] > 60)):
-        print("Solar Data: Time delta cannot be more than 60 minutes")
+    # Does the slot use set times and the off time is the same as the on time? (an off
+    # time before the on time is fine, the slot runs overnight)
+    if (slot.on_trigger == SETTIME) and (slot.off_trigger == SETTIME) and (slot.off_value == slot.on_value):
+        log.error("Set time: Off time can't be the same as the on time", slot=slot)
         return False
 
     # we got this far, return True
-    print("Slot is valid")
+    log.debug("Slot is valid", slot=slot)
     return True
 
 
 def check_for_solar_events():
     # return true if any of the slots use a solar trigger (sunrise or sunset)
-    global slots
-
-    # iterate through the slots
-    for slot in np.nditer(slots):
-        # Do the on or off triggers for this slot use solar?
-        if slot['onTrigger'] < SETTIME or slot['offTrigger'] < SETTIME:
-            # then we're done, we're solar!
-            return True
+    # iterate through every channel's slots
+    for relay_pin, channel_slots in channels:
+        for slot in channel_slots:
+            # Do the on or off triggers for this slot use solar?
+            if slot.uses_solar_data():
+                # then we're done, we're solar!
+                return True
     return False
 
 
 def get_solar_times():
+    # populate the sunrise and sunset values for today, returns True if they were
+    # updated or False if they weren't (or will be updated later, in the background)
     global time_sunrise
     global time_sunset
 
-    # used to convert the string time values from the API into a Python date/time object
-    format_str = "%I:%M:%S %p"
+    if SOLAR_SOURCE == "api":
+        return get_solar_times_api()
 
-    print("\nRequesting solar data from", SOLAR_API_URL)
-    payload = {"lat": LOC_LAT, "lng": LOC_LONG, "date": "today"}
+    log.debug("Calculating solar data")
+    started = time.perf_counter()
     try:
-        res = requests.get(SOLAR_API_URL, params=payload)
-        # did we get a result?
-        if res.status_code == requests.codes.ok:
-            data = res.json()
-            # time comes in as a string, in UTC time, but with no timezone data.
-            # it must be converted into a format we can use...
-            time_sunrise = adjust_time_utc(datetime.strptime(data['results']['sunrise'], format_str))
-            print("Sunrise:", str(time_sunrise))
-            time_sunset = adjust_time_utc(datetime.strptime(data['results']['sunset'], format_str))
-            print("Sunset:", str(time_sunset))
-        else:
-            print("Unable to obtain solar data; server returned", res.status_code)
+        import solar_calc
+
+        time_sunrise, time_sunset = solar_calc.get_solar_times(float(LOC_LAT), float(LOC_LONG), clock.now().date())
+        log.info("Solar data", sunrise=time_sunrise, sunset=time_sunset)
+        metrics.observe("solar_fetch_seconds", time.perf_counter() - started)
+        return True
     except ValueError as e:
-        print("Value Error:", e)
+        log.error("Value Error", error=e)
     except Exception as e:
-        print("Unexpected error:", e)
+        log.error("Unexpected error", error=e)
+    metrics.inc("solar_fetch_failures_total")
+    return False
+
+
+def get_solar_times_api():
+    # get today's solar data from the cache, then top up the cache in the background
+    # (only days that aren't already in the cache get requested). If today wasn't in the
+    # cache, the process loop gets told when the request finishes so it can try again
+    import solar_api
+    import solar_cache
+
+    today = clock.now().date()
+    cached = set_solar_times(solar_cache.get(LOC_LAT, LOC_LONG, today))
+    callback = None
+    if not cached:
+        callback = lambda fetched: scheduler.post(EVENT_SOLAR_DATA, fetched)
+    log.debug("Requesting solar data", url=solar_api.SOLAR_API_URL)
+    solar_api.prefetch_async(LOC_LAT, LOC_LONG, SOLAR_PREFETCH_DAYS, callback, today)
+    return cached
+
+
+def set_solar_times(times):
+    # apply the sunrise and sunset times (UTC, 24 hour format) from the solar data cache
+    global time_sunrise
+    global time_sunset
+
+    if times is None:
+        log.warning("Solar data for today isn't available")
+        return False
+    # the times are in UTC, they must be converted to local time
+    sunrise = adjust_time_utc(datetime(1900, 1, 1, times[0] // 100, times[0] % 100))
+    sunset = adjust_time_utc(datetime(1900, 1, 1, times[1] // 100, times[1] % 100))
+    time_sunrise = sunrise
+    time_sunset = sunset
+    log.info("Solar data", sunrise=time_sunrise, sunset=time_sunset)
+    return True
 
 
 def adjust_time_utc(time_val):
-    # http://stackoverflow.com/questions/4770297/python-convert-utc-datetime-string-to-local-datetime
-    # time_val input value is assumed to be coming from the call to the solar data API
-    # therefore, the time will be a UTC time, but without the timezone data included with it.
-    # convert the time value to local time based on timezone
-    # time_val.replace(tzinfo=pytz.utc) adds timezone information (utc) to time_val
-    # time_val.astimezone(tzlocal.get_localzone()) returns the time value in the current timezone
-
-    # several users reported a problem with the time conversion (UTC to local). time_val doesn't have
-    # a date component, so the conversion was failing.
-    # Fix provided by Chris Nichols: Since the time_val comes in with the year defined as 1900/01/01,
-    # we need to correct that in order to get the shift for the time zones right.
-    time_val = time_val.replace(year=datetime.now().year, month=datetime.now().month, day=datetime.now().day)
-    # Returning now to my code
-    return get_time_24(time_val.replace(tzinfo=pytz.utc).astimezone(tzlocal.get_localzone()))
+    # converts time_val, a UTC time, to local time (24 hour format). time_val comes from the
+    # solar data, so it doesn't have a (useful) date; the conversion has to use today's date,
+    # or the daylight saving time offset comes out wrong (Fix provided by Chris Nichols)
+    today = clock.now()
+    time_val = time_val.replace(year=today.year, month=today.month, day=today.day, tzinfo=clock.utc)
+    # the local timezone's offsets are looked up once and cached (see tz_table.py)
+    return get_time_24(tz_table.to_local(time_val))
 
 
 def get_time_24(time_val):
@@ -285,102 +783,167 @@ def get_time_24(time_val):
         return -1
 
 
-def build_daily_slots_array():
-    # This function builds daily_slots based on the current settings in the slots array
-    # the application makes NO EFFORT to ensure unique slots. If your slots array contains
+def build_daily_slots_array(previous=None):
+    # This function builds daily_slots based on the current settings in each channel's slots
+    # list. The application makes NO EFFORT to ensure unique slots. If your slots list contains
     # any overlapping time windows, then so be it. Sorry.
+    # previous is an earlier slot_windows list, slots that are still in a channel's slots list
+    # keep the on/off times they had, only new (or changed) slots get new ones
     global daily_slots
+    global slot_windows
+    global timelines
+    global transition_times
 
-    print("\nBuilding slots array")
+    log.info("Building slots array")
     daily_slots = []
-    # iterate through the slots array, adding the on_time and off_time values to the daily_slots array
-    for slot in np.nditer(slots):
-        # get some data from the slot
-        do_random = slot['doRandom']
-        on_time = parse_slot_time(slot['onTrigger'], slot['onValue'])
-        off_time = parse_slot_time(slot['offTrigger'], slot['offValue'])
-        if do_random:
-            # make random slots between on_time and off_time
-            # set the initial on time to on_time
-            ont = on_time
-            # repeat the following until we're past off_time
-            while ont < off_time:
-                # calculate an off time using a random value from 5 to 60
-                oft = inc_time(ont, random.randint(5, 60))
-                # is our new off time > off_time?
-                if oft > off_time:
-                    # then set it to off_time, turn it off at off_time
-                    oft = off_time
-                # save the  random 'slot' to the array
-                # cast to int just to make sure
-                daily_slots.append([int(ont), int(oft)])
-                # reset on time to the current off time + plus some random int
-                # this is when it goes on again next
-                ont = inc_time(oft, random.randint(5, 60))
-        else:
-            # is the on time BEFORE the off time? (can't be equal either)
-            if on_time < off_time:
-                # then add the slot to the list of daily slots
-                # cast to int just to make sure
-                daily_slots.append([int(on_time), int(off_time)])
+    slot_windows = []
+    timelines = []
+    transitions = set()
+    # first, figure out which slots keep their previous on/off times (a slot can be in a
+    # channel's list more than once), and which ones need new ones
+    plans = []
+    new_slots = []
+    for channel, (relay_pin, channel_slots) in enumerate(channels):
+        kept = {}
+        if previous is not None and channel < len(previous):
+            for slot, windows in previous[channel]:
+                kept.setdefault(slot, []).append(windows)
+        plan = []
+        for slot in channel_slots:
+            if kept.get(slot):
+                plan.append((slot, kept[slot].pop(0)))
             else:
-                print("Skipping slot, on_time is AFTER off_time")
-    # print the slots list, a separate line for each slot
-    daily_slots.sort()
-    for slot in daily_slots:
-        print(slot)
-    print()
-
-
-def inc_time(time_val, increment):
-    # get the number of minutes
-    mins = time_val % 100
-    # figure out the hours
-    hours = (time_val / 100)
-    # increment minutes
-    new_mins = mins + increment
-    # did we go over an hour boundary? (assuming we're adding no more than 60 minutes)
-    if new_mins > 59:
-        # then decrement the minutes
-        new_mins -= 60
-        hours += 1
-        if hours > 23:
-            # return 11:59 PM
-            return 2359
-    # return our results
-    if hours > 0:
-        # cast to int just to make sure
-        return int((hours * 100) + new_mins)
-    else:
-        # cast to int just to make sure
-        return int(new_mins)
+                plan.append((slot, None))
+                new_slots.append(slot)
+        plans.append(plan)
+    # then build the new ones, all at once
+    new_windows = iter(build_slot_windows(new_slots))
+    for channel, plan in enumerate(plans):
+        pairs = [(slot, next(new_windows) if windows is None else windows) for slot, windows in plan]
+        slot_windows.append(pairs)
+        daily_slots.append(sorted(window for slot, windows in pairs for window in windows))
+        timelines.append(build_timeline(daily_slots[channel]))
+        transitions.update(get_transitions(timelines[channel]))
+        # log the slots list (only kept in memory, unless you're logging debug records)
+        log.debug("Daily slots", relay=channel, slots=daily_slots[channel])
+    transition_times = sorted(minutes.to_time_24(minute) for minute in transitions)
+    log.debug("Built slots", built=len(new_slots), kept=sum(len(pairs) for pairs in slot_windows) - len(new_slots))
+
+
+def build_slot_windows(slot_list, sunrise=None, sunset=None):
+    # returns a list with the on/off times (24 hour format) for today for each slot in the list.
+    # If a slot's off time is before its on time, the slot runs overnight. sunrise and sunset
+    # (24 hour format) default to today's time_sunrise and time_sunset
+    result = []
+    random_slots = []
+    for slot, (on_time, off_time) in zip(slot_list, parse_slot_times(slot_list, sunrise, sunset)):
+        # where the slot ends, counting past midnight for an overnight slot
+        end_time = on_time + minutes.length(on_time, off_time)
+        if end_time == on_time:
+            log.warning("Skipping slot, on_time is the same as off_time", slot=slot)
+            result.append([])
+        elif slot.do_random:
+            # filled in below
+            result.append(None)
+            random_slots.append((len(result) - 1, slot, on_time, end_time))
+        else:
+            # add the slot to the list of daily slots
+            result.append([[minutes.to_time_24(on_time), minutes.to_time_24(off_time)]])
+    if random_slots:
+        # make random slots between each slot's on_time and off_time, on (and then off) for a
+        # random number of minutes (from the slot's min_minutes to max_minutes) at a time
+        spans = minutes.random_spans_many(get_random(), [row[2] for row in random_slots],
+                                          [row[3] for row in random_slots],
+                                          [row[1].min_minutes for row in random_slots],
+                                          [row[1].max_minutes for row in random_slots])
+        for (index, slot, on_time, end_time), slot_spans in zip(random_slots, spans):
+            result[index] = [[minutes.to_time_24(ont), minutes.to_time_24(oft)] for ont, oft in slot_spans]
+    return result
+
+
+def get_random():
+    # returns the random number generator used for the random slots (a NumPy Generator)
+    if rng is None:
+        seed_random(RANDOM_SEED)
+    return rng
+
+
+def seed_random(seed=None):
+    # start the random number generator over, with seed (None picks a different one every time)
+    global rng
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+
+
+def build_timeline(channel_slots):
+    # returns a timeline (a bytearray with one entry per minute of the day) for the list
+    # of on/off times (24 hour format). Overlapping slots just merge together, an off
+    # time before the on time runs overnight (it's on at the end and the start of the day)
+    timeline = bytearray(MINUTES_PER_DAY)
+    for on_time, off_time in channel_slots:
+        for start, end in minutes.spans(minutes.from_time_24(on_time), minutes.from_time_24(off_time)):
+            timeline[start:end] = b"\x01" * (end - start)
+    return timeline
+
+
+def get_transitions(timeline):
+    # returns the list of minutes (after midnight) where the timeline turns on or off
+    result = []
+    position = 0
+    # the day starts where the previous one ended (an overnight slot is still on at midnight)
+    state = timeline[-1]
+    while 1:
+        # find the next minute that's different from the current state
+        position = timeline.find(1 - state, position)
+        if position < 0:
+            return result
+        result.append(position)
+        state = 1 - state
 
 
-def parse_slot_time(slot_trigger, slot_val):
-    # return a time value based on the slot passed into the function
+def parse_slot_time(slot_trigger, slot_val, sunrise=None, sunset=None):
+    # return a time value (minutes after midnight) based on the slot passed into the function.
+    # sunrise and sunset (24 hour format) default to today's time_sunrise and time_sunset
     if slot_trigger == SETTIME:
         # return the time value
-        return int(slot_val)
+        return minutes.from_time_24(slot_val)
     if slot_trigger == SUNRISE:
         # return the calculated solar sunrise time
-        return int(inc_time(time_sunrise, slot_val))
+        return minutes.add(minutes.from_time_24(time_sunrise if sunrise is None else sunrise), slot_val)
     # return the calculated solar sunset time
-    return int(inc_time(time_sunset, slot_val))
-
-
-def is_on_time():
+    return minutes.add(minutes.from_time_24(time_sunset if sunset is None else sunset), slot_val)
+
+
+def parse_slot_times(slot_list, sunrise=None, sunset=None):
+    # returns a list with the (on, off) times (minutes after midnight) for each slot in the list.
+    # Long lists are done in one go using NumPy
+    if sunrise is None:
+        sunrise = time_sunrise
+    if sunset is None:
+        sunset = time_sunset
+    if len(slot_list) < BATCH_SIZE:
+        return [(parse_slot_time(slot.on_trigger, slot.on_value, sunrise, sunset),
+                 parse_slot_time(slot.off_trigger, slot.off_value, sunrise, sunset)) for slot in slot_list]
+    # each time is a base time (midnight, sunrise or sunset) plus an offset; for set times, the
+    # time itself is the offset
+    bases = {SETTIME: 0, SUNRISE: minutes.from_time_24(sunrise), SUNSET: minutes.from_time_24(sunset)}
+    triggers = [slot.on_trigger for slot in slot_list] + [slot.off_trigger for slot in slot_list]
+    values = [slot.on_value for slot in slot_list] + [slot.off_value for slot in slot_list]
+    offsets = minutes.from_time_24_many(values)
+    is_solar = [trigger != SETTIME for trigger in triggers]
+    offsets[is_solar] = [value for value, solar in zip(values, is_solar) if solar]
+    times = minutes.add_many([bases[trigger] for trigger in triggers], offsets).tolist()
+    return list(zip(times[:len(slot_list)], times[len(slot_list):]))
+
+
+def is_on_time(channel=0):
     # Are we in an ON mode? In other words, is the current time between any of the
-    # slot's on and off times?
-    # Start by getting the current time (in 24 hour format)
-    curr_time = get_time_24(datetime.now())
-    # if you want to use UTC, replace the previous line with the following:
-    # curr_time = get_time_24(datetime.utcnow())
-    # look through all of the daily slot values
-    for slot in daily_slots:
-        # if current time is between on/off times, then we're True
-        if slot[0] < curr_time < slot[1]:
-            return True
-    return False
+    # channel's slot's on and off times?
+    # Start by getting the current time (in minutes after midnight, going by the schedule's time)
+    curr_time = minutes.of_day(tz_table.schedule_time(clock.utcnow()))
+    # then look it up in the channel's timeline
+    return timelines[channel][curr_time] == 1
 
 
 # ============================================================================
@@ -393,18 +956,44 @@ print(hashes)
 
 if __name__ == "__main__":
     try:
-        # Turn the relay off to start (just to make sure)
-        relay.set_status(False)
+        try:
+            load_schedule()
+        except (IOError, OSError, ValueError) as e:
+            log.error("INVALID SCHEDULE FILE", path=SCHEDULE_FILE, error=e)
+            log.flush()
+            sys.exit(1)
+        init_hardware()
+        # Turn the relays off to start (just to make sure)
+        relay.set_all(False)
+        log.LEVEL = LOG_LEVEL
+        if LOG_FILE:
+            log.set_output(LOG_FILE)
+        # don't lose the waiting log records when systemd (or kill) stops the controller
+        log.flush_on_terminate()
+        start_metrics()
         # do we have a valid set of slots?
         if validate_slots():
             init_app()
+            watch_schedule()
+            start_control_server()
+            start_shared_state()
+            install_profiler()
             process_loop()
         else:
             # then we can't run, and we need to terminate
-            print("\nINVALID SLOT(S) DEFINITION")
+            log.error("INVALID SLOT(S) DEFINITION")
             sys.exit(1)
     except KeyboardInterrupt:
-        print("\nExiting application\n")
-        # turn the relay off, just to make sure.
-        relay.set_status(False)
+        log.info("Exiting application")
+        # turn the relays off, just to make sure.
+        relay.set_all(False)
+        publish_state()
+        log.flush()
         sys.exit(0)
+    except Exception as e:
+        # log what happened (the lead up to it is in the log's ring buffer),
+        # turn the relays off, just to make sure.
+        log.error("Unexpected error, exiting", error=repr(e))
+        relay.set_all(False)
+        log.flush()
+        raise
@@ -0,0 +1,467 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Fleet Mode
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Drives the relays on lots of Pis from one place. Instead of running controller.py, each Pi runs the pigpio
+#    daemon (sudo pigpiod), and this process keeps a connection open to every one of them (talking to it through
+#    pigpio's socket interface, so the pigpio library isn't needed here). It works out all of
+#    the Pis' schedules itself (the sunrise and sunset times are calculated once for each location, not once per
+#    Pi), and each time a relay is supposed to change, it sends each Pi all of its changes at once: one command
+#    turns on every relay that's supposed to go on, another turns off the ones that are supposed to go off. A Pi
+#    that drops off the network is reconnected in the background (waiting a little longer after every failed
+#    try), and its relays are put back where they belong as soon as it's back. It also reads every Pi's relays at
+#    least every CHECK_INTERVAL seconds and puts back any that aren't where they belong, so a Pi that rebooted
+#    (and came back with its relays off) is caught up within a minute. Each Pi's command round trip times are at
+#    http://localhost:9112/fleet.
+#
+#    The Pis are listed in fleet.json. Their channels are set up just like schedule.json's (see
+#    schedule.example.json); lat and long are where the Pi is (they default to LOC_LAT and LOC_LONG in
+#    controller.py). All of the Pis have to be in this computer's timezone.
+#
+#        {"hosts": [{"name": "porch", "host": "192.168.1.20", "port": 8888, "lat": "35.227085",
+#                    "long": "-80.843124", "channels": [{"pin": 18, "slots": [["SETTIME", 700, "SETTIME", 900, false]]}]}]}
+#
+#    Run python fleet_demo.py 20 to try it out with 20 stand-in pigpio daemons on this computer.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import clock
+import controller
+import log
+import metrics
+import minutes
+import schedule_file
+import scheduler
+import solar_calc
+
+# ============================================================================
+# User adjustable values
+# ============================================================================
+# the list of Pis
+FLEET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fleet.json")
+# the port the metrics (and each Pi's round trip times) are served on, None turns it off. It's
+# not the controller's port (9110), so the fleet can run on a Pi that's running the controller
+METRICS_PORT = 9112
+# how long (in seconds) to wait for a Pi to connect, or to answer a command
+CONNECT_TIMEOUT = 5
+COMMAND_TIMEOUT = 2
+# how often (in seconds) to check that every Pi is still there and its relays are where they're
+# supposed to be (a Pi that rebooted comes back with its relays off), even if none of them change
+CHECK_INTERVAL = 60
+# how long (in seconds) to wait before trying to reconnect to a Pi, doubling after every
+# failed try, up to RECONNECT_MAX
+RECONNECT_MIN = 1
+RECONNECT_MAX = 60
+# how many Pis get their changes sent at the same time
+SEND_THREADS = 16
+# how many of each Pi's round trip times are kept (for the percentiles)
+LATENCY_SAMPLES = 1000
+# ============================================================================
+
+# event posted when a Pi (re)connects, its data is the host
+EVENT_CONNECTED = "connected"
+
+# the pigpio commands the fleet uses (see pigpio's socket interface, http://abyz.me.uk/rpi/pigpio/sif.html):
+# set a pin's mode, read the levels of GPIO 0 to 31, and clear or set the ones in a bit mask
+PI_CMD_MODES = 0
+PI_CMD_BR1 = 10
+PI_CMD_BC1 = 12
+PI_CMD_BS1 = 14
+# the output pin mode
+PI_OUTPUT = 1
+# a command and its response: the command, two parameters and the length of any extra data (the
+# response has the command's result in its place)
+COMMAND = struct.Struct("<IIII")
+
+# the fleet's hosts
+hosts = []
+# the day (a date) the hosts' schedules were last built for
+built_on = None
+# the times (24 hour format) when any of the hosts' relays are supposed to change
+transition_times = []
+# each location's (lat, long) last sunrise and sunset times (24 hour format)
+solar_times = {}
+# the threads that send the hosts their changes
+executor = None
+
+metrics.describe("fleet_command_seconds", "Round trip time of the commands sent to the hosts")
+metrics.describe("fleet_command_failures_total", "Number of times a host stopped answering")
+metrics.describe("fleet_connects_total", "Number of times a host (re)connected")
+metrics.describe("fleet_resyncs_total", "Number of times a host's relays weren't where they were put")
+metrics.describe("fleet_solar_calculations_total", "Number of sunrise and sunset calculations")
+metrics.describe("scheduler_lateness_seconds", "How long after the planned time transitions actually ran")
+metrics.gauge("fleet_hosts", lambda: len(hosts), "Number of hosts in the fleet")
+metrics.gauge("fleet_hosts_connected", lambda: sum(1 for host in hosts if host.connected()),
+              "Number of hosts that are connected")
+
+
+class PigpioConnection(object):
+    # A connection to a Pi's pigpio daemon. Each command is sent and answered on its own, and
+    # anything that goes wrong (the Pi doesn't answer within COMMAND_TIMEOUT, the connection
+    # closes, the daemon returns an error) raises IOError (or OSError)
+
+    def __init__(self, address, port):
+        self._socket = socket.create_connection((address, port), CONNECT_TIMEOUT)
+        self._socket.settimeout(COMMAND_TIMEOUT)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def command(self, command, p1=0, p2=0):
+        # send the command, returns its result (an unsigned 32 bit number)
+        self._socket.sendall(COMMAND.pack(command, p1, p2, 0))
+        response = receive(self._socket, COMMAND.size)
+        if response is None:
+            raise IOError("The connection closed")
+        return COMMAND.unpack(response)[3]
+
+    def checked_command(self, command, p1=0, p2=0):
+        # send a command whose result is an error code (negative) if it failed
+        result = self.command(command, p1, p2)
+        if result & 0x80000000:
+            raise IOError("pigpio error %d" % (result - 0x100000000))
+        return result
+
+    def close(self):
+        self._socket.close()
+
+
+def receive(connection, size):
+    # returns size bytes from the socket, or None if it closed
+    data = b""
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class Host(object):
+    # One of the fleet's Pis: its schedule, and the connection to its pigpio daemon
+
+    def __init__(self, name, address, port, location, channels):
+        self.name = name
+        self.address = address
+        self.port = port
+        # (lat, long)
+        self.location = location
+        # [(relay_pin, [Slot, ...]), ...], just like controller.py's
+        self.channels = channels
+        # the relays' pins, as a bit mask (bit 0 is GPIO 0). The bank commands only reach GPIO 0 to 31
+        self.pins = 0
+        for relay_pin, channel_slots in channels:
+            if not 0 <= relay_pin < 32:
+                raise ValueError("Host %s: relay pins have to be GPIO 0 to 31, not %d" % (name, relay_pin))
+            self.pins |= 1 << relay_pin
+        self.daily_slots = []
+        self.timelines = []
+        # the pigpio connection, and the pins (a bit mask) last set on, None if we haven't yet
+        self.connection = None
+        self.sent = None
+        self.lock = threading.Lock()
+        self.reconnecting = False
+        self.connects = 0
+        self.failures = 0
+        self.commands = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def connected(self):
+        return self.connection is not None
+
+    def connect(self):
+        # connect to the Pi's pigpio daemon and make its relay pins outputs (leaving them
+        # on or off, whichever they are). Raises IOError (or OSError) if it can't
+        connection = PigpioConnection(self.address, self.port)
+        try:
+            for relay_pin, channel_slots in self.channels:
+                connection.checked_command(PI_CMD_MODES, relay_pin, PI_OUTPUT)
+        except Exception:
+            connection.close()
+            raise
+        with self.lock:
+            self.connection = connection
+            self.sent = None
+            self.connects += 1
+
+    def disconnect(self):
+        with self.lock:
+            connection = self.connection
+            self.connection = None
+            self.sent = None
+        if connection is not None:
+            connection.close()
+
+    def desired(self, minute):
+        # returns the pins (a bit mask) that are supposed to be on at minute (minutes after midnight)
+        result = 0
+        for (relay_pin, channel_slots), timeline in zip(self.channels, self.timelines):
+            if timeline[minute]:
+                result |= 1 << relay_pin
+        return result
+
+    def _command(self, command, p1=0):
+        # send a command (timing it), returns its result
+        started = time.perf_counter()
+        if command == PI_CMD_BR1:
+            # (the result is the pins' levels, not an error code)
+            result = self.connection.command(command, p1)
+        else:
+            result = self.connection.checked_command(command, p1)
+        elapsed = time.perf_counter() - started
+        self.latencies.append(elapsed)
+        metrics.observe("fleet_command_seconds", elapsed)
+        self.commands += 1
+        return result
+
+    def sync(self, desired):
+        # send the Pi the changes that get its relays to desired (a bit mask of the pins
+        # that are supposed to be on), all of them at once: one command turns on the ones
+        # that need to go on, another turns off the ones that need to go off. Returns the
+        # number of changes sent. Raises an exception if the Pi stops answering
+        with self.lock:
+            if self.connection is None:
+                return 0
+            # read where the relays actually are first (it's a quick command), so a Pi that
+            # rebooted, or whose relays were changed behind our back, gets put right
+            levels = self._command(PI_CMD_BR1) & self.pins
+            if self.sent is not None and levels != self.sent:
+                metrics.inc("fleet_resyncs_total")
+                log.warning("Host's relays aren't where they were put, putting them back", host=self.name,
+                            expected=self.sent, actual=levels)
+            changes = 0
+            for bits, command in ((desired & ~levels, PI_CMD_BS1), (levels & ~desired, PI_CMD_BC1)):
+                if bits:
+                    self._command(command, bits)
+                    changes += 1
+            self.sent = desired
+            return changes
+
+    def latency(self, fraction):
+        # returns the fraction (0.5 for the median) percentile of the Pi's recent round trip
+        # times (in seconds), or None if there aren't any
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+def load_fleet(path):
+    # returns the list of hosts in the fleet file, raises ValueError if it isn't formatted
+    # correctly (or IOError if it can't be read)
+    with open(path) as fleet_file:
+        data = json.load(fleet_file)
+    result = []
+    try:
+        for entry in data["hosts"]:
+            name = str(entry.get("name", entry["host"]))
+            channels = schedule_file.parse(entry)
+            if not controller.validate_slots(channels):
+                raise ValueError("Invalid slot(s) for host %s" % name)
+            location = (str(entry.get("lat", controller.LOC_LAT)), str(entry.get("long", controller.LOC_LONG)))
+            result.append(Host(name, entry["host"], int(entry.get("port", 8888)), location, channels))
+    except (KeyError, TypeError) as e:
+        raise ValueError("Invalid fleet file: %s" % e)
+    if not result:
+        raise ValueError("Invalid fleet file: no hosts")
+    if len(set(host.name for host in result)) != len(result):
+        raise ValueError("Invalid fleet file: host names have to be different")
+    return result
+
+
+def connect_all():
+    # start connecting to every host (in the background)
+    global executor
+
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=SEND_THREADS)
+    for host in hosts:
+        start_reconnect(host)
+
+
+def start_reconnect(host):
+    # keep trying to connect to the host in the background, the process loop gets an
+    # EVENT_CONNECTED when it does
+    with host.lock:
+        if host.reconnecting:
+            return
+        host.reconnecting = True
+    thread = threading.Thread(target=_reconnect, args=(host,), name="connect-" + host.name)
+    thread.daemon = True
+    thread.start()
+
+
+def _reconnect(host):
+    delay = RECONNECT_MIN
+    while 1:
+        try:
+            host.connect()
+            break
+        except Exception as e:
+            log.debug("Unable to connect to host", host=host.name, retry=delay, error=e)
+            # wait a random part of the delay, so a fleet that lost its network doesn't all
+            # come back at the same moment
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, RECONNECT_MAX)
+    host.reconnecting = False
+    metrics.inc("fleet_connects_total")
+    log.info("Connected to host", host=host.name, address="%s:%d" % (host.address, host.port))
+    scheduler.post(EVENT_CONNECTED, host)
+
+
+def build_schedules():
+    # work out today's daily slots (and timelines) for every host. The sunrise and sunset
+    # times are calculated once for each location, and each location's slots are built in
+    # one batch (using the controller's slot builder)
+    global built_on
+    global transition_times
+
+    # (if it's before 12:01 AM, today's rebuild still has to run)
+    built_on = (clock.now() - timedelta(minutes=1)).date()
+    locations = {}
+    for host in hosts:
+        locations.setdefault(host.location, []).append(host)
+    transitions = set()
+    for location, group in locations.items():
+        slot_list = [slot for host in group for relay_pin, channel_slots in host.channels for slot in channel_slots]
+        # start from the location's last times (or the controller's defaults), if the calculation
+        # fails those get used
+        sunrise, sunset = solar_times.get(location, (controller.time_sunrise, controller.time_sunset))
+        if any(slot.uses_solar_data() for slot in slot_list):
+            try:
+                sunrise, sunset = solar_calc.get_solar_times(float(location[0]), float(location[1]),
+                                                             clock.now().date())
+                metrics.inc("fleet_solar_calculations_total")
+            except ValueError as e:
+                log.error("Unable to calculate solar data, using the last times", lat=location[0],
+                          long=location[1], error=e)
+            log.debug("Solar data", lat=location[0], long=location[1], sunrise=sunrise, sunset=sunset)
+        solar_times[location] = (sunrise, sunset)
+        windows = iter(controller.build_slot_windows(slot_list, sunrise, sunset))
+        for host in group:
+            host.daily_slots = []
+            host.timelines = []
+            for relay_pin, channel_slots in host.channels:
+                channel_windows = sorted(window for slot in channel_slots for window in next(windows))
+                timeline = controller.build_timeline(channel_windows)
+                host.daily_slots.append(channel_windows)
+                host.timelines.append(timeline)
+                transitions.update(controller.get_transitions(timeline))
+    transition_times = sorted(minutes.to_time_24(minute) for minute in transitions)
+    log.info("Built schedules", hosts=len(hosts), locations=len(locations), transitions=len(transition_times))
+
+
+def sync_all():
+    # check every connected host's relays, and send it the changes it needs to get them
+    # where they're supposed to be right now, all of the hosts at the same time. Returns
+    # the number of changes sent
+    minute = minutes.of_day(clock.now())
+    jobs = []
+    for host in hosts:
+        if host.connected():
+            jobs.append((host, executor.submit(host.sync, host.desired(minute))))
+    changes = 0
+    for host, job in jobs:
+        try:
+            changes += job.result()
+        except Exception as e:
+            host.failures += 1
+            metrics.inc("fleet_command_failures_total")
+            log.warning("Lost the connection to host, reconnecting", host=host.name, error=repr(e))
+            host.disconnect()
+            start_reconnect(host)
+    return changes
+
+
+def turn_off_all():
+    # turn off every connected host's relays, then let go of the connections
+    for host in hosts:
+        if host.connected():
+            try:
+                host.sync(0)
+            except Exception as e:
+                log.warning("Unable to turn off host's relays", host=host.name, error=repr(e))
+            host.disconnect()
+
+
+def process_loop():
+    # sleep until the next time any of the hosts' relays are supposed to change (or a host
+    # connects, or it's time to check on them), then send all of the hosts their changes
+    while 1:
+        # the schedules get rebuilt every day at 12:01 AM (that's 1 in 24 hour time)
+        next_time = scheduler.next_event_time(transition_times + [1], clock.utcnow())
+        wake_time = min(next_time, clock.utcnow() + timedelta(seconds=CHECK_INTERVAL))
+        event_type, data = scheduler.wait_until(wake_time)
+        if event_type == scheduler.EVENT_TIMER and data == next_time:
+            metrics.observe("scheduler_lateness_seconds", (clock.utcnow() - data).total_seconds())
+        now = clock.now()
+        if built_on != now.date() and minutes.of_day(now) >= 1:
+            build_schedules()
+        # like the controller, compare where each host's relays are supposed to be with where
+        # they actually are, so a host that just connected, rebooted or missed a change catches up
+        sync_all()
+
+
+def render_stats():
+    # returns each host's connection and round trip stats, as text
+    lines = ["%-16s %-22s %-9s %8s %8s %8s %9s %9s %9s" % (
+        "Host", "Address", "Connected", "Connects", "Failures", "Commands", "p50 (ms)", "p99 (ms)", "max (ms)")]
+    for host in hosts:
+        values = [host.latency(fraction) for fraction in (0.5, 0.99, 1.0)]
+        lines.append("%-16s %-22s %-9s %8d %8d %8d %s" % (
+            host.name, "%s:%d" % (host.address, host.port), "yes" if host.connected() else "no", host.connects,
+            host.failures, host.commands,
+            " ".join("%9s" % ("-" if value is None else "%.3f" % (value * 1000)) for value in values)))
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the relays on a fleet of Pis")
+    parser.add_argument("--file", default=FLEET_FILE, help="the fleet file")
+    args = parser.parse_args()
+    # don't lose the waiting log records when systemd (or kill) stops the fleet
+    log.flush_on_terminate()
+
+    try:
+        hosts[:] = load_fleet(args.file)
+    except (IOError, OSError, ValueError) as e:
+        log.error("INVALID FLEET FILE", path=args.file, error=e)
+        log.flush()
+        sys.exit(1)
+    if METRICS_PORT:
+        try:
+            metrics.start_server(METRICS_PORT)
+            metrics.add_page("/fleet", render_stats)
+            metrics.add_page("/log", log.render_recent)
+        except (IOError, OSError) as e:
+            log.warning("Unable to serve metrics, running without them", port=METRICS_PORT, error=e)
+    connect_all()
+    build_schedules()
+    try:
+        process_loop()
+    finally:
+        turn_off_all()
+        log.flush()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        log.info("Exiting application")
+        log.flush()
+        sys.exit(0)
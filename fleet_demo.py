@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Fleet Demo
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Tries fleet mode (fleet.py) out without a room full of Pis. It starts stand-in pigpio daemons on this computer,
+#    runs the fleet against them for a couple of days on a virtual clock (so it only takes a few seconds), unplugs
+#    one of them for a while along the way and switches another one's relays behind the fleet's back, then checks
+#    that every one of them ended up with its relays where they're supposed to be.
+#
+#    Usage: python fleet_demo.py [hosts] [--days 2] [--port 18888] [--latency 0] [--seed 1]
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import clock
+import controller
+import fleet
+import log
+import metrics
+import minutes
+import schedule_file
+import scheduler
+
+# the schedule every stand-in Pi gets
+SCHEDULE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schedule.example.json")
+# where the stand-in Pis are: half in Charlotte, half in New York
+LOCATIONS = [(controller.LOC_LAT, controller.LOC_LONG), ("40.712776", "-74.005974")]
+
+
+class StandInDaemon(object):
+    # A stand-in for a Pi's pigpio daemon. It understands just enough of pigpio's socket
+    # interface for the fleet (pin modes and the bank commands), levels holds its pins'
+    # levels (bit 0 is GPIO 0), and it waits latency seconds before answering each command
+
+    def __init__(self, port, address="127.0.0.1", latency=0):
+        self.address = address
+        self.port = port
+        self.latency = latency
+        self.levels = 0
+        self.modes = {}
+        self.commands = 0
+        self._server = None
+        self._clients = set()
+
+    def running(self):
+        return self._server is not None
+
+    def start(self):
+        daemon = self
+
+        class Handler(socketserver.BaseRequestHandler):
+
+            def handle(self):
+                daemon._clients.add(self.request)
+                try:
+                    while 1:
+                        request = fleet.receive(self.request, fleet.COMMAND.size)
+                        if request is None:
+                            break
+                        command, p1, p2, p3 = fleet.COMMAND.unpack(request)
+                        if p3 and fleet.receive(self.request, p3) is None:
+                            break
+                        result = daemon.command(command, p1, p2)
+                        if daemon.latency:
+                            time.sleep(daemon.latency)
+                        self.request.sendall(fleet.COMMAND.pack(command, p1, p2, result & 0xffffffff))
+                except (IOError, OSError):
+                    pass
+                finally:
+                    daemon._clients.discard(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((self.address, self.port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name="pigpiod-%d" % self.port)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        # stop answering (and drop every connection), like a Pi that's been unplugged
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for client in list(self._clients):
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError):
+                pass
+
+    def command(self, command, p1, p2):
+        # returns the result of a pigpio command
+        self.commands += 1
+        if command == fleet.PI_CMD_MODES:
+            self.modes[p1] = p2
+        elif command == fleet.PI_CMD_BR1:
+            return self.levels
+        elif command == fleet.PI_CMD_BS1:
+            self.levels |= p1
+        elif command == fleet.PI_CMD_BC1:
+            self.levels &= ~p1
+        else:
+            # PI_BAD_PARAM, the fleet doesn't send anything else
+            return -81
+        return 0
+
+
+class StopDemo(Exception):
+    # raised when the demo's virtual clock reaches the end of the demo
+    pass
+
+
+def demo(num_hosts, days, port, latency, seed):
+    # run the fleet for a few (virtual) days against stand-in pigpio daemons on this computer. One
+    # of them gets unplugged for a while part way through, and later on the last one's relays get
+    # switched behind the fleet's back. Then check that every host's relays ended up where they're
+    # supposed to be
+    hosts = fleet.hosts
+    # reconnect quickly, the virtual days go by fast
+    fleet.RECONNECT_MIN = 0.05
+    fleet.RECONNECT_MAX = 0.5
+    daemons = [StandInDaemon(port + i, latency=latency) for i in range(num_hosts)]
+    for daemon in daemons:
+        daemon.start()
+    channels = schedule_file.load(SCHEDULE_FILE)
+    hosts[:] = [fleet.Host("pi%02d" % i, daemon.address, daemon.port, LOCATIONS[i % len(LOCATIONS)], channels)
+                for i, daemon in enumerate(daemons)]
+
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + timedelta(days=days)
+    unplug_at = start + timedelta(days=days / 3.0)
+    plug_in_at = start + timedelta(days=days / 2.0)
+    switch_at = start + timedelta(days=days * 2 / 3.0)
+    # when the last host's relays got switched, and when they were put back
+    switched = []
+    virtual_clock = clock.VirtualClock(start)
+
+    def virtual_wait(timeout):
+        # give the connection threads a moment (of real time) to do their thing, then move
+        # the virtual clock forward
+        event = scheduler.wait_for_event(0.001)
+        if event is not None:
+            return event
+        now = virtual_clock.now()
+        if now >= end:
+            raise StopDemo()
+        if unplug_at <= now < plug_in_at and daemons[0].running():
+            log.info("Unplugging host", host=hosts[0].name)
+            daemons[0].stop()
+        elif now >= plug_in_at and not daemons[0].running():
+            log.info("Plugging host back in", host=hosts[0].name)
+            # it lost power, so its relays are all off
+            daemons[0].levels = 0
+            daemons[0].start()
+        if now >= switch_at and not switched:
+            log.info("Switching host's relays", host=hosts[-1].name)
+            daemons[-1].levels ^= hosts[-1].pins
+            switched.append(now)
+        elif len(switched) == 1 and daemons[-1].levels & hosts[-1].pins == hosts[-1].sent:
+            switched.append(now)
+        virtual_clock.advance(timeout)
+        return None
+
+    controller.seed_random(seed)
+    virtual_clock.install()
+    scheduler.set_waiter(virtual_wait)
+    started = time.time()
+    try:
+        fleet.connect_all()
+        fleet.build_schedules()
+        fleet.process_loop()
+    except StopDemo:
+        pass
+    finally:
+        scheduler.set_waiter(None)
+    elapsed = time.time() - started
+    log.flush()
+    # one last pass, then check each stand-in's pins against the schedule
+    fleet.sync_all()
+    minute = minutes.of_day(clock.now())
+    right = sum(1 for host, daemon in zip(hosts, daemons) if daemon.levels & host.pins == host.desired(minute))
+    print(fleet.render_stats())
+    print("Ran %d hosts for %d days in %.2f seconds" % (len(hosts), days, elapsed))
+    print("Solar calculations:", metrics.get("fleet_solar_calculations_total"))
+    print("Commands sent:", sum(host.commands for host in hosts))
+    if len(switched) == 2:
+        print("Switched relays put back after %d seconds" % (switched[1] - switched[0]).total_seconds())
+    print("Relay resyncs:", metrics.get("fleet_resyncs_total"))
+    print("Hosts with their relays where they're supposed to be: %d of %d" % (right, len(hosts)))
+    fleet.turn_off_all()
+    for daemon in daemons:
+        daemon.stop()
+    clock.reset_clock()
+    return right == len(hosts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Try fleet mode out with stand-in pigpio daemons on this computer")
+    parser.add_argument("hosts", type=int, nargs="?", default=20, help="how many stand-in Pis to run")
+    parser.add_argument("--days", type=int, default=2, help="how many (virtual) days to run for")
+    parser.add_argument("--port", type=int, default=18888, help="the first stand-in daemon's port")
+    parser.add_argument("--latency", type=float, default=0, help="the stand-in daemons' latency (in seconds)")
+    parser.add_argument("--seed", type=int, default=1, help="the random number generator seed")
+    args = parser.parse_args()
+    if not demo(args.hosts, args.days, args.port, args.latency, args.seed):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nExiting application\n")
+        sys.exit(0)
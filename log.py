@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Logging
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    A small structured logger built to go easy on the Pi's SD card. Log records (a level, a message and any
+#    number of key=value fields) are kept in an in-memory ring buffer, and only written out in batches: when
+#    enough of them pile up, when the oldest has waited FLUSH_INTERVAL seconds (a background thread keeps an eye
+#    on that, so records don't wait for the controller to wake up), or right away for warnings and errors.
+#    The ring buffer also holds the debug records that never get written, so after something goes wrong you can
+#    still see what happened leading up to it (recent() returns them, the metrics server shows them at /log).
+#    Waiting records are written when the program exits, and (after flush_on_terminate) when it's killed with
+#    SIGTERM, which is what systemd and kill send.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import atexit
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+
+import clock
+
+# log levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+# records at this level and above get written out, everything else only goes in the ring buffer
+LEVEL = INFO
+# records at this level and above get written out right away (along with anything waiting)
+FLUSH_LEVEL = WARNING
+# write the waiting records when there are this many of them...
+BATCH_SIZE = 50
+# ...or when the oldest one has been waiting this long (in seconds)
+FLUSH_INTERVAL = 300
+# how many records the ring buffer holds
+BUFFER_SIZE = 1000
+# how records are written: "kv" (key=value) or "json"
+FORMAT = "kv"
+
+# (reentrant, so the SIGTERM handler can flush even if it interrupted a thread that was logging)
+_lock = threading.RLock()
+# the most recent records, written out or not
+_history = deque(maxlen=BUFFER_SIZE)
+# the records waiting to be written
+_pending = []
+# when the oldest waiting record was logged (on the monotonic clock)
+_pending_since = None
+# where records get written, None means standard output
+_output = None
+# the background thread that writes records that have waited FLUSH_INTERVAL seconds (the
+# controller can sleep for hours, so it can't be left to the process loop)
+_flusher = None
+
+
+def set_output(path):
+    # write records to a file (appending to it) instead of standard output
+    global _output
+
+    flush()
+    if _output is not None:
+        _output.close()
+    _output = open(path, "a") if path else None
+
+
+def log(level, msg, **fields):
+    # add a record to the log
+    global _pending_since
+
+    record = (clock.now(), level, msg, fields)
+    with _lock:
+        _history.append(record)
+        if level < LEVEL:
+            return
+        if not _pending:
+            _pending_since = time.monotonic()
+        _pending.append(record)
+        flush_now = level >= FLUSH_LEVEL or len(_pending) >= BATCH_SIZE
+        if _flusher is None:
+            _start_flusher()
+    if flush_now:
+        flush()
+
+
+def _start_flusher():
+    # start the background thread that writes records once they've waited FLUSH_INTERVAL seconds
+    global _flusher
+
+    _flusher = threading.Thread(target=_flush_loop, name="log-flush")
+    _flusher.daemon = True
+    _flusher.start()
+
+
+def _flush_loop():
+    while 1:
+        with _lock:
+            wait = FLUSH_INTERVAL
+            if _pending:
+                wait = _pending_since + FLUSH_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        else:
+            flush()
+
+
+def debug(msg, **fields):
+    log(DEBUG, msg, **fields)
+
+
+def info(msg, **fields):
+    log(INFO, msg, **fields)
+
+
+def warning(msg, **fields):
+    log(WARNING, msg, **fields)
+
+
+def error(msg, **fields):
+    log(ERROR, msg, **fields)
+
+
+def flush():
+    # write all of the waiting records, in a single write
+    global _pending
+
+    with _lock:
+        if not _pending:
+            return
+        records = _pending
+        _pending = []
+    output = _output if _output is not None else sys.stdout
+    try:
+        output.write("".join(format_record(record) + "\n" for record in records))
+        output.flush()
+    except (IOError, OSError, ValueError):
+        # nowhere to write them, but they're still in the ring buffer
+        pass
+
+
+def flush_on_terminate():
+    # write the waiting records when the process gets a SIGTERM, then let it do whatever it would
+    # have done without this (by default, that's exit). Call it from the main thread
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handler(signum, frame):
+        try:
+            flush()
+        except RuntimeError:
+            # it interrupted a write to the output, the records are still in the ring buffer
+            pass
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, handler)
+
+
+# and write them when the program exits normally (sys.exit, or the end of the main program)
+atexit.register(flush)
+
+
+def _format_value(value):
+    value = str(value)
+    if not value or " " in value or "=" in value or '"' in value:
+        return json.dumps(value)
+    return value
+
+
+def format_record(record):
+    # returns the record as a single line of text
+    timestamp, level, msg, fields = record
+    if FORMAT == "json":
+        data = {"time": timestamp.isoformat(), "level": LEVEL_NAMES.get(level, level), "msg": msg}
+        data.update(fields)
+        return json.dumps(data, default=str)
+    parts = ["time=" + timestamp.isoformat(timespec="seconds"), "level=" + LEVEL_NAMES.get(level, str(level)),
+             "msg=" + _format_value(msg)]
+    parts.extend("%s=%s" % (key, _format_value(value)) for key, value in sorted(fields.items()))
+    return " ".join(parts)
+
+
+def recent(count=None, level=DEBUG):
+    # returns the most recent records (all of them, or the last count) at or above level
+    with _lock:
+        records = [record for record in _history if record[1] >= level]
+    if count is not None:
+        records = records[-count:]
+    return records
+
+
+def render_recent():
+    # returns the records in the ring buffer as text, oldest first
+    return "".join(format_record(record) + "\n" for record in recent())
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Metrics
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Keeps counters and timings for the controller (how late transitions fire, how long GPIO writes take, solar
+#    fetch failures and so on) and serves them in Prometheus text format on a local HTTP port, so you can see
+#    what a unit is doing without digging through its output:
+#
+#        curl http://localhost:9110/metrics
+#
+#    Recording a metric is just a dictionary update, so they're cheap enough to leave on all the time.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import threading
+
+import log
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+# every metric name gets this prefix
+PREFIX = "relay_"
+
+_lock = threading.Lock()
+# name: value
+_counters = {}
+# name: [count, sum, max]
+_summaries = {}
+# name: function that returns the gauge's current value
+_gauges = {}
+# name: help text
+_help = {}
+# extra pages served along with the metrics, path: function that returns the page's text
+_pages = {}
+
+# the HTTP server (once it's started)
+_server = None
+
+
+def describe(name, help_text):
+    # set the help text shown for a metric
+    _help[name] = help_text
+
+
+def inc(name, amount=1):
+    # add amount to a counter
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, value):
+    # record a value (a duration in seconds, for example) for a summary
+    with _lock:
+        summary = _summaries.get(name)
+        if summary is None:
+            _summaries[name] = [1, value, value]
+        else:
+            summary[0] += 1
+            summary[1] += value
+            if value > summary[2]:
+                summary[2] = value
+
+
+def gauge(name, func, help_text=None):
+    # register a gauge, func gets called (with no arguments) to get its value every time
+    # the metrics are read
+    _gauges[name] = func
+    if help_text:
+        describe(name, help_text)
+
+
+def get(name):
+    # returns a counter's value (or a summary's [count, sum, max])
+    with _lock:
+        if name in _summaries:
+            return list(_summaries[name])
+        return _counters.get(name, 0)
+
+
+def add_page(path, func):
+    # serve the text returned by func (called with no arguments) at path
+    _pages[path] = func
+
+
+def render():
+    # returns all of the metrics in Prometheus text format
+    lines = []
+
+    def header(name, metric_type):
+        if name in _help:
+            lines.append("# HELP %s%s %s" % (PREFIX, name, _help[name]))
+        lines.append("# TYPE %s%s %s" % (PREFIX, name, metric_type))
+
+    with _lock:
+        counters = sorted(_counters.items())
+        summaries = sorted((name, list(values)) for name, values in _summaries.items())
+    for name, value in counters:
+        header(name, "counter")
+        lines.append("%s%s %s" % (PREFIX, name, value))
+    for name, (count, total, maximum) in summaries:
+        header(name, "summary")
+        lines.append("%s%s_count %d" % (PREFIX, name, count))
+        lines.append("%s%s_sum %.6f" % (PREFIX, name, total))
+        lines.append("# TYPE %s%s_max gauge" % (PREFIX, name))
+        lines.append("%s%s_max %.6f" % (PREFIX, name, maximum))
+    for name, func in sorted(_gauges.items()):
+        header(name, "gauge")
+        try:
+            lines.append("%s%s %s" % (PREFIX, name, func()))
+        except Exception as e:
+            lines.append("# %s%s unavailable: %s" % (PREFIX, name, e))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path in ("/", "/metrics"):
+            body = render()
+        elif path in _pages:
+            body = _pages[path]()
+        else:
+            self.send_error(404)
+            return
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # don't log every request
+        pass
+
+
+def start_server(port, host="127.0.0.1"):
+    # serve the metrics on a background thread. By default, only local clients can connect.
+    # Raises IOError (or OSError) if the port can't be used (something else is using it)
+    global _server
+
+    if _server is not None:
+        return _server
+    _server = HTTPServer((host, port), MetricsHandler)
+    log.info("Serving metrics", url="http://%s:%d/metrics" % (host, port))
+    thread = threading.Thread(target=_server.serve_forever, name="metrics")
+    thread.daemon = True
+    thread.start()
+    return _server
+
+
+def stop_server():
+    global _server
+
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
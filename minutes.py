@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Minute Math
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Time math for the controller. Times are kept as the number of minutes after midnight (0 to 1439), so adding
+#    an offset is just addition, and anything that goes past midnight wraps around to the other side. Time
+#    windows can run overnight (on at 22:00, off at 02:00). The *_many functions do the same thing to a whole
+#    list (or NumPy array) of times in one call; NumPy is only loaded when they're used.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+# the number of minutes in a day
+MINUTES_PER_DAY = 24 * 60
+
+
+def from_time_24(time_val):
+    # converts a time (24 hour format, 1730 = 5:30 PM) into the number of minutes after midnight
+    time_val = int(time_val)
+    return (time_val // 100) * 60 + time_val % 100
+
+
+def to_time_24(minutes):
+    # converts the number of minutes after midnight into a time (24 hour format), wrapping
+    # around midnight (1500 minutes is 1:00 AM)
+    minutes = int(minutes) % MINUTES_PER_DAY
+    return (minutes // 60) * 100 + minutes % 60
+
+
+def is_time_24(time_val):
+    # returns True if time_val is a valid time (24 hour format)
+    return 0 <= time_val <= 2359 and time_val % 100 < 60
+
+
+def of_day(time_val):
+    # returns the number of minutes after midnight for a datetime
+    return time_val.hour * 60 + time_val.minute
+
+
+def add(minutes, offset):
+    # returns the time offset minutes (any number, positive or negative) after minutes, wrapping around midnight
+    return (minutes + offset) % MINUTES_PER_DAY
+
+
+def add_time_24(time_val, offset):
+    # returns the time (24 hour format) offset minutes after time_val (also 24 hour format)
+    return to_time_24(from_time_24(time_val) + offset)
+
+
+def length(on_minutes, off_minutes):
+    # returns the length (in minutes) of the window from on_minutes to off_minutes, if off_minutes
+    # is before on_minutes, the window runs overnight
+    return (off_minutes - on_minutes) % MINUTES_PER_DAY
+
+
+def spans(on_minutes, off_minutes):
+    # returns the window from on_minutes to off_minutes as a list of (start, end) spans that don't
+    # cross midnight (an overnight window is split in two)
+    if on_minutes < off_minutes:
+        return [(on_minutes, off_minutes)]
+    if on_minutes > off_minutes:
+        result = [(on_minutes, MINUTES_PER_DAY)]
+        if off_minutes > 0:
+            result.append((0, off_minutes))
+        return result
+    return []
+
+
+def from_time_24_many(time_vals):
+    # from_time_24 for a list of times, returns a NumPy array
+    import numpy as np
+    time_vals = np.asarray(time_vals, dtype=np.int64)
+    return (time_vals // 100) * 60 + time_vals % 100
+
+
+def add_many(minutes, offsets):
+    # add for a list of times and a list (or a single value) of offsets, returns a NumPy array
+    import numpy as np
+    return (np.asarray(minutes, dtype=np.int64) + np.asarray(offsets, dtype=np.int64)) % MINUTES_PER_DAY
+
+
+def random_spans_many(rng, starts, ends, min_lengths, max_lengths):
+    # returns, for each window (from starts[i] to ends[i], in minutes), a list of random (on, off) spans
+    # inside it: each one min_lengths[i] to max_lengths[i] minutes long, with min_lengths[i] to
+    # max_lengths[i] minutes between them. The last span is cut off at the end of the window. rng is
+    # a NumPy random number Generator; the spans' lengths are drawn from it in two calls for each
+    # group of windows (see below)
+    import numpy as np
+    starts = np.asarray(starts, dtype=np.int64)
+    if not len(starts):
+        return []
+    ends = np.asarray(ends, dtype=np.int64)
+    lows = np.asarray(min_lengths, dtype=np.int64)[:, None]
+    highs = np.asarray(max_lengths, dtype=np.int64)[:, None]
+    # each window needs enough spans to fill it with the shortest on and off times. Windows that need
+    # about as many (the same power of two) are done together, so one window with short spans doesn't
+    # make every window's arrays that big
+    counts = (ends - starts) // (2 * lows[:, 0]) + 1
+    groups = np.ceil(np.log2(counts)).astype(np.int64)
+    result = [None] * len(starts)
+    for group in np.unique(groups):
+        rows = np.flatnonzero(groups == group)
+        count = int(counts[rows].max())
+        on_lengths = rng.integers(lows[rows], highs[rows], size=(len(rows), count), endpoint=True)
+        off_lengths = rng.integers(lows[rows], highs[rows], size=(len(rows), count), endpoint=True)
+        # each span starts after all of the spans (and the gaps between them) before it
+        cycles = on_lengths + off_lengths
+        span_starts = starts[rows, None] + np.cumsum(cycles, axis=1) - cycles
+        span_ends = np.minimum(span_starts + on_lengths, ends[rows, None])
+        inside = span_starts < ends[rows, None]
+        for row, on, off, keep in zip(rows.tolist(), span_starts, span_ends, inside):
+            result[row] = list(zip(on[keep].tolist(), off[keep].tolist()))
+    return result
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Profiler
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Finds out where a running controller spends its time, without stopping it. Start a profiling session by
+#    sending the controller a SIGUSR1 signal:
+#
+#        sudo kill -USR1 <the controller's process id>
+#
+#    or start the controller with the RELAY_PROFILE environment variable set (to the number of seconds to
+#    profile for). For the next PROFILE_SECONDS seconds, a background thread samples what the controller is
+#    doing, tracemalloc tracks its memory, and the functions it was given get timed; then the results are
+#    written to a file and everything goes back to normal. Nothing is wrapped or sampled when a session isn't
+#    running, so it costs nothing the rest of the time.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import collections
+import functools
+import os
+import signal
+import sys
+import threading
+import time
+
+import clock
+import log
+import metrics
+
+# the environment variable that starts a session when the controller starts
+PROFILE_ENV = "RELAY_PROFILE"
+# how long (in seconds) a session lasts
+PROFILE_SECONDS = 60
+# how often (in seconds) the sampling profiler looks at what the controller is doing
+SAMPLE_INTERVAL = 0.005
+# where the results go
+PROFILE_DIR = os.path.dirname(os.path.abspath(__file__))
+# how many lines of each report section to write
+REPORT_LINES = 25
+
+# the (module, function name) pairs that get timed during a session
+_targets = []
+# the running session's thread
+_session = None
+_lock = threading.Lock()
+
+
+def install(targets, signal_number=None):
+    # get ready to profile: targets is a list of (module, function name) pairs to time. A session
+    # starts when the signal (SIGUSR1 by default) arrives, or right away if PROFILE_ENV is set
+    _targets[:] = targets
+    if signal_number is None:
+        signal_number = getattr(signal, "SIGUSR1", None)
+    if signal_number is not None:
+        # the handler only starts a thread, so it's safe to call whatever the controller's doing
+        signal.signal(signal_number, lambda signum, frame: start())
+    if os.environ.get(PROFILE_ENV):
+        try:
+            start(float(os.environ[PROFILE_ENV]))
+        except ValueError:
+            start()
+
+
+def start(seconds=None):
+    # start a profiling session on a background thread, returns False if one's already running
+    global _session
+
+    with _lock:
+        if _session is not None and _session.is_alive():
+            return False
+        _session = threading.Thread(target=_run, args=(seconds or PROFILE_SECONDS, threading.main_thread().ident),
+                                    name="profiler")
+        _session.daemon = True
+        _session.start()
+    return True
+
+
+def _timed(func, timings):
+    # returns a wrapper for func that adds each call's time to timings[name] ([calls, total, max])
+    name = getattr(func, "__module__", "?") + "." + func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            timing = timings[name]
+            timing[0] += 1
+            timing[1] += elapsed
+            if elapsed > timing[2]:
+                timing[2] = elapsed
+
+    return wrapper
+
+
+def _stack(frame):
+    # returns the frame's stack, outermost call first, as a tuple of "file:function:line" strings
+    result = []
+    while frame is not None:
+        code = frame.f_code
+        result.append("%s:%s:%d" % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    return tuple(reversed(result))
+
+
+def _summary(name):
+    # returns the summary metric's [count, sum, max], all zeros if nothing's been recorded yet
+    value = metrics.get(name)
+    return value if isinstance(value, list) else [0, 0.0, 0.0]
+
+
+def _run(seconds, thread_id):
+    import tracemalloc
+
+    log.warning("Profiling started", seconds=seconds)
+    timings = collections.defaultdict(lambda: [0, 0.0, 0.0])
+    originals = []
+    stacks = collections.Counter()
+    started_tracing = not tracemalloc.is_tracing()
+    loop_before = _summary("loop_iteration_seconds")
+    try:
+        # swap in the timed versions of the target functions
+        for module, name in _targets:
+            func = getattr(module, name, None)
+            if callable(func):
+                originals.append((module, name, func))
+                setattr(module, name, _timed(func, timings))
+        if started_tracing:
+            tracemalloc.start(10)
+        memory_before = tracemalloc.take_snapshot()
+        started = time.monotonic()
+        samples = 0
+        while time.monotonic() - started < seconds:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[_stack(frame)] += 1
+                samples += 1
+            del frame
+            time.sleep(SAMPLE_INTERVAL)
+        memory_after = tracemalloc.take_snapshot()
+        elapsed = time.monotonic() - started
+    except Exception as e:
+        log.error("Profiling failed", error=repr(e))
+        return
+    finally:
+        # put the original functions back
+        for module, name, func in originals:
+            setattr(module, name, func)
+        if started_tracing:
+            tracemalloc.stop()
+
+    loop_after = _summary("loop_iteration_seconds")
+    lines = ["Controller profile, %s, %.1f seconds, %d samples" % (clock.now().isoformat(timespec="seconds"),
+                                                                    elapsed, samples),
+             "process_loop: %d events handled in %.6f seconds" % (loop_after[0] - loop_before[0],
+                                                                   loop_after[1] - loop_before[1])]
+    lines.append("\nFunction timings (calls, total seconds, max seconds):")
+    for name, (calls, total, maximum) in sorted(timings.items(), key=lambda item: -item[1][1]):
+        lines.append("  %-50s %8d %12.6f %12.6f" % (name, calls, total, maximum))
+
+    # what the sampled stacks were doing right then (the innermost frame), then the whole stacks
+    own = collections.Counter()
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+    lines.append("\nTop frames (samples, %):")
+    for frame_name, count in own.most_common(REPORT_LINES):
+        lines.append("  %8d %5.1f%%  %s" % (count, 100.0 * count / max(samples, 1), frame_name))
+    lines.append("\nTop stacks (samples; folded, outermost call first):")
+    for stack, count in stacks.most_common(REPORT_LINES):
+        lines.append("%d %s" % (count, ";".join(stack)))
+
+    lines.append("\nMemory allocated during the session (by line):")
+    # leaving out the profiler's own
+    ignore = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+    memory_before = memory_before.filter_traces(ignore)
+    memory_after = memory_after.filter_traces(ignore)
+    for stat in memory_after.compare_to(memory_before, "lineno")[:REPORT_LINES]:
+        lines.append("  " + str(stat))
+    _write_report(lines)
+
+
+def _write_report(lines):
+    # write the report to a new file in PROFILE_DIR
+    path = os.path.join(PROFILE_DIR, "profile-%s.txt" % clock.now().strftime("%Y%m%d-%H%M%S"))
+    temp_file = path + ".tmp"
+    try:
+        with open(temp_file, "w") as report_file:
+            report_file.write("\n".join(lines) + "\n")
+        os.replace(temp_file, path)
+        log.warning("Profiling finished", path=path)
+    except (IOError, OSError) as e:
+        log.error("Unable to save profile", path=path, error=e)
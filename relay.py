@@ -1,58 +1,218 @@
+import time
+
 import gpiozero
 
-# used to track the current state of the relay. At the start, the
-# application turns the relay off then sets this variable's value
-# the application can then later query this to determine what the
-# current state is for the relay, in the toggle function for example.
-_relay_status = False
+import clock
+import log
+import metrics
 
-relay = None
+# the shortest time (in seconds) a relay stays on, or off, before it's switched again. A change
+# that comes sooner than that waits until the time's up (and is dropped if the relay's supposed
+# to be back where it is by then), so a flurry of changes can't chatter a mechanical relay
+MIN_ON_TIME = 5
+MIN_OFF_TIME = 5
 
+metrics.describe("transitions_total", "Number of times a relay was switched on or off")
+metrics.describe("gpio_write_seconds", "Time spent writing to the relays' GPIO pins")
+metrics.describe("writes_suppressed_total", "Number of relay changes skipped because the relay was already there")
+metrics.describe("writes_deferred_total", "Number of relay changes delayed by the minimum on/off time")
+metrics.describe("writes_cancelled_total", "Number of delayed relay changes dropped because they were undone")
 
-def init(relay_pin):
-    # initialize the relay object
-    print("Initializing relay object")
-    global relay
-    relay = gpiozero.OutputDevice(relay_pin, active_high=True, initial_value=False)
 
+class RelayBank(object):
+    # A bank of relays, one per GPIO pin (a multi-channel relay board, for example).
+    # Channels are numbered from 0, in the order their pins were passed in. The bank
+    # keeps track of each relay's status, so it only writes to the hardware when a
+    # relay's status actually changes, and no more often than min_on and min_off allow.
 
-def status():
-    return _relay_status
+    def __init__(self, relay_pins, pin_factory=None, min_on=None, min_off=None):
+        log.info("Initializing relay bank", pins=list(relay_pins))
+        self.pins = list(relay_pins)
+        self.devices = [gpiozero.OutputDevice(pin, active_high=True, initial_value=False, pin_factory=pin_factory)
+                        for pin in self.pins]
+        self.min_on = MIN_ON_TIME if min_on is None else min_on
+        self.min_off = MIN_OFF_TIME if min_off is None else min_off
+        # used to track the current state of each relay
+        self._status = [False] * len(self.devices)
+        # when (on the monotonic clock) each relay was last switched
+        self._changed_at = [None] * len(self.devices)
+        # changes waiting for a relay's minimum on/off time to pass, channel: status
+        self._pending = {}
+        # functions called with (channel, status) every time a relay changes
+        self.listeners = []
 
+    def __len__(self):
+        return len(self.devices)
 
-def set_status(the_status):
-    # sets the relay's status based on the boolean value passed to the function
-    # a value of True turns the relay on, a value of False turns the relay off
-    global _relay_status
-    global relay
+    def status(self, channel=0):
+        return self._status[channel]
+
+    def statuses(self):
+        # returns a list with the status of every relay in the bank
+        return list(self._status)
+
+    def set_status(self, channel, the_status, force=False):
+        # sets the relay's status based on the boolean value passed to the function
+        # a value of True turns the relay on, a value of False turns the relay off.
+        # Returns True if the relay was written to (force skips the minimum on/off time)
+        return self.apply({channel: the_status}, force) > 0
+
+    def toggle(self, channel):
+        # flips the relay's status (or the status it's waiting to change to)
+        return self.set_status(channel, not self._pending.get(channel, self._status[channel]))
+
+    def apply(self, changes, force=False):
+        # applies a batch of status changes (a dictionary of channel: status) in one go,
+        # only writing to the relays whose status is different, and whose minimum on/off
+        # time has passed (the rest wait for it, see flush_pending). Returns the number of
+        # relays written to
+        written = 0
+        now = clock.monotonic()
+        for channel, the_status in changes.items():
+            the_status = bool(the_status)
+            pending = self._pending.pop(channel, None)
+            if self._status[channel] == the_status:
+                if pending is not None:
+                    # the relay was waiting to change, but it's supposed to stay put after all
+                    metrics.inc("writes_cancelled_total")
+                else:
+                    metrics.inc("writes_suppressed_total")
+                continue
+            ready_at = self._ready_at(channel)
+            if not force and ready_at > now:
+                if pending is None:
+                    metrics.inc("writes_deferred_total")
+                    log.info("Relay change deferred", relay=channel, status="ON" if the_status else "OFF",
+                             seconds=round(ready_at - now, 1))
+                self._pending[channel] = the_status
+                continue
+            self._write(channel, the_status, now)
+            written += 1
+        return written
+
+    def next_deadline(self):
+        # returns when (on the monotonic clock) the next waiting change can be written, or None
+        if not self._pending:
+            return None
+        return min(self._ready_at(channel) for channel in self._pending)
 
-    if relay is not None:
-        _relay_status = the_status
+    def flush_pending(self):
+        # writes the waiting changes whose relay's minimum on/off time has passed, returns the
+        # number of relays written to
+        written = 0
+        now = clock.monotonic()
+        for channel, the_status in list(self._pending.items()):
+            if self._ready_at(channel) <= now:
+                del self._pending[channel]
+                self._write(channel, the_status, now)
+                written += 1
+        return written
 
+    def _ready_at(self, channel):
+        # when (on the monotonic clock) the relay can be switched again
+        if self._changed_at[channel] is None:
+            return 0
+        return self._changed_at[channel] + (self.min_on if self._status[channel] else self.min_off)
+
+    def _write(self, channel, the_status, now):
+        # (writing a relay's current status again doesn't start its minimum on/off time over)
+        if self._status[channel] != the_status:
+            self._changed_at[channel] = now
+        self._status[channel] = the_status
+        log.info("Setting relay", relay=channel, status="ON" if the_status else "OFF")
+        started = time.perf_counter()
         if the_status:
-            print("Setting relay: ON")
-            relay.on()
+            self.devices[channel].on()
         else:
-            print("Setting relay: OFF")
-            relay.off()
+            self.devices[channel].off()
+        metrics.observe("gpio_write_seconds", time.perf_counter() - started)
+        metrics.inc("transitions_total")
+        self._notify(channel)
+
+    def _notify(self, channel):
+        for listener in self.listeners:
+            listener(channel, self._status[channel])
+
+    def set_all(self, the_status):
+        # sets every relay in the bank to the same status, right away, whether it needs it
+        # or not (it's used to put the relays in a safe state)
+        self._pending.clear()
+        now = clock.monotonic()
+        for channel in range(len(self.devices)):
+            self._write(channel, the_status, now)
+
+    def close(self):
+        for device in self.devices:
+            device.close()
+
+
+# the relay bank used by the module level functions below
+bank = None
+
+
+def init(relay_pin):
+    # initialize the relay object
+    init_bank([relay_pin])
+
+
+def init_bank(relay_pins, pin_factory=None):
+    # initialize the relay bank with a relay on each pin
+    global bank
+    if bank is not None:
+        bank.close()
+    bank = RelayBank(relay_pins, pin_factory)
+
+
+def status(channel=0):
+    if bank is None:
+        return False
+    return bank.status(channel)
+
+
+def set_status(the_status, channel=0):
+    # sets the relay's status based on the boolean value passed to the function
+    # a value of True turns the relay on, a value of False turns the relay off
+    if bank is not None:
+        bank.set_status(channel, the_status)
     else:
-        print("You must initialize the relay before you can use it")
+        log.error("You must initialize the relay before you can use it")
 
 
-def toggle():
+def toggle(channel=0):
     # toggles the relay's status. If the relay is on, when you call this function,
     # it will turn the relay off. If the relay is off, when you call this function,
     # it will turn the relay on. Easy peasy, right?
-    global _relay_status
-    global relay
-
-    if relay is not None:
-        # flip our relay status value
-        _relay_status = not _relay_status
-        if _relay_status:
-            print("Toggling relay: ON")
-        else:
-            print("Toggling relay: OFF")
-        relay.toggle()
+    if bank is not None:
+        bank.toggle(channel)
+    else:
+        log.error("You must initialize the relay before you can use it")
+
+
+def apply(changes):
+    # applies a batch of status changes (a dictionary of channel: status) to the relay bank
+    if bank is not None:
+        return bank.apply(changes)
+    log.error("You must initialize the relay before you can use it")
+    return 0
+
+
+def next_deadline():
+    # returns when (on the monotonic clock) the relay bank's next delayed change is due, or None
+    if bank is None:
+        return None
+    return bank.next_deadline()
+
+
+def flush_pending():
+    # writes the relay bank's delayed changes that are due
+    if bank is None:
+        return 0
+    return bank.flush_pending()
+
+
+def set_all(the_status):
+    # sets every relay in the relay bank to the same status
+    if bank is not None:
+        bank.set_all(the_status)
     else:
-        print("You must initialize the relay before you can use it")
+        log.error("You must initialize the relay before you can use it")
@@ -9,6 +9,7 @@ import sys
 import time
 
 import gpiozero
+import log
 import relay
 
 # set this variable to the GPIO pin the relay is connected to
@@ -16,6 +17,11 @@ RELAY_PIN = 18
 
 
 def main_loop():
+    # write the relay's log records right away, rather than in batches
+    log.FLUSH_LEVEL = log.DEBUG
+    # this test switches the relay every second, so turn off the minimum on/off time
+    relay.MIN_ON_TIME = 0
+    relay.MIN_OFF_TIME = 0
     # initialize the relay, nothing will work until you do
     relay.init(RELAY_PIN)
     # Turn the relay off, just to make sure it starts off
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Schedule File
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Loads the relay channels and their slots from a JSON file, so you can change the schedule without touching
+#    (or restarting) the controller, and watches the file for changes. The file looks like this:
+#
+#    {
+#      "channels": [
+#        {"pin": 18, "slots": [
+#          ["SETTIME", 700, "SETTIME", 900, false],
+#          ["SUNRISE", 15, "SUNSET", -10, true]
+#        ]}
+#      ]
+#    }
+#
+#    Each slot has the same format as the Slot objects in controller.py: OnTrigger, OnValue, OffTrigger, OffValue,
+#    doRandom, and optionally the shortest and longest random on/off times (in minutes). On Linux, the watcher uses inotify (through ctypes, so there's nothing to install), everywhere else
+#    it checks the file's modification time every few seconds.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import threading
+import time
+
+import log
+from slot import SETTIME, SUNRISE, SUNSET, Slot
+
+# the trigger names used in the file
+TRIGGERS = {"SETTIME": SETTIME, "SUNRISE": SUNRISE, "SUNSET": SUNSET}
+
+# when inotify isn't available, how often (in seconds) to check the file for changes
+POLL_INTERVAL = 5
+# editors often write a file in several steps, wait this long (in seconds) after the
+# last change before reading it
+SETTLE_TIME = 0.5
+
+# inotify flags (from sys/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+# the header of each inotify event: wd, mask, cookie, len (followed by the file name)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _parse_trigger(value):
+    if isinstance(value, int):
+        return value
+    try:
+        return TRIGGERS[str(value).upper()]
+    except KeyError:
+        raise ValueError("Unknown trigger: %s" % value)
+
+
+def parse(data):
+    # returns the channels list ([(relay_pin, [Slot, ...]), ...]) for the file's (decoded) contents,
+    # raises ValueError if it isn't formatted correctly
+    try:
+        channels = []
+        for channel in data["channels"]:
+            channel_slots = []
+            for row in channel["slots"]:
+                if len(row) not in (5, 7):
+                    raise ValueError("A slot needs 5 (or 7) values: %s" % row)
+                channel_slots.append(Slot(_parse_trigger(row[0]), row[1], _parse_trigger(row[2]), *row[3:]))
+            channels.append((int(channel["pin"]), channel_slots))
+    except (KeyError, TypeError) as e:
+        raise ValueError("Invalid schedule: %s" % e)
+    if not channels:
+        raise ValueError("Invalid schedule: no channels")
+    return channels
+
+
+def load(path):
+    # returns the channels list defined in the file at path
+    with open(path) as schedule_file:
+        return parse(json.load(schedule_file))
+
+
+class Watcher(object):
+    # calls callback (from a background thread, with no arguments) whenever the file at path changes
+
+    def __init__(self, path, callback):
+        self.path = os.path.abspath(path)
+        self.callback = callback
+        self._stop = threading.Event()
+        self._fd = self._init_inotify()
+        target = self._watch_inotify if self._fd is not None else self._watch_mtime
+        self._thread = threading.Thread(target=target, name="schedule-watcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _init_inotify(self):
+        # returns an inotify file descriptor watching the file's folder (so editors that replace the
+        # file, rather than write to it, get noticed too), or None if inotify isn't available
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(IN_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            if libc.inotify_add_watch(fd, os.path.dirname(self.path).encode(), mask) < 0:
+                os.close(fd)
+                return None
+        except (OSError, AttributeError):
+            return None
+        log.debug("Watching schedule file with inotify", path=self.path)
+        return fd
+
+    def _read_names(self):
+        # returns the names of the files in the inotify events waiting to be read
+        names = set()
+        data = os.read(self._fd, 4096)
+        position = 0
+        while position + EVENT_HEADER.size <= len(data):
+            length = EVENT_HEADER.unpack_from(data, position)[3]
+            position += EVENT_HEADER.size
+            names.add(data[position:position + length].rstrip(b"\0").decode(errors="replace"))
+            position += length
+        return names
+
+    def _watch_inotify(self):
+        name = os.path.basename(self.path)
+        try:
+            while not self._stop.is_set():
+                if not select.select([self._fd], [], [], 1)[0]:
+                    continue
+                if name not in self._read_names():
+                    continue
+                # wait for the file to settle, soaking up any more events for it
+                while select.select([self._fd], [], [], SETTLE_TIME)[0]:
+                    self._read_names()
+                if not self._stop.is_set():
+                    self.callback()
+        finally:
+            os.close(self._fd)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime, stat.st_size
+        except OSError:
+            return None
+
+    def _watch_mtime(self):
+        log.debug("Watching schedule file for changes", path=self.path, interval=POLL_INTERVAL)
+        last = self._stat()
+        while not self._stop.wait(POLL_INTERVAL):
+            current = self._stat()
+            if current != last:
+                time.sleep(SETTLE_TIME)
+                last = self._stat()
+                self.callback()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
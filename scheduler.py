@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Scheduler
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Rather than waking up several times a second to see whether the minute changed, the controller asks this
+#    module when the next thing is supposed to happen (a relay transition or the nightly slot rebuild), then sleeps
+#    until exactly that moment. Sleeping is done against the monotonic clock, so changes to the system time don't
+#    affect it. If the wall clock jumps while we're asleep (an NTP sync), the scheduler notices when it wakes up
+#    and tells the controller so it can re-plan. Times are planned in UTC, so daylight saving time changes aren't
+#    jumps: on the day it starts, times in the skipped hour happen when the clock jumps ahead, and on the day it
+#    ends, times in the repeated hour only happen once.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import sys
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import clock
+import tz_table
+
+# event types returned by wait_until
+EVENT_TIMER = "timer"
+EVENT_CLOCK_JUMP = "clock_jump"
+
+# the longest we'll sleep without checking whether the wall clock moved under us (in seconds)
+MAX_SLEEP = 300
+# how far (in seconds) the wall clock can move away from the monotonic clock while we're
+# asleep before we treat it as a clock jump
+JUMP_TOLERANCE = 2
+
+# counts the number of times the scheduler woke up, handy for keeping an eye on power use
+wakeups = 0
+# counts the number of times the wall clock jumped
+clock_jumps = 0
+
+# everything that can wake the controller up (other than the timer) is posted to this queue
+_events = queue.Queue()
+# called (with no arguments) every time wait_until wakes up to check the wall clock and goes back
+# to sleep, so at least every MAX_SLEEP seconds however long the wait is. See set_tick
+_tick = None
+
+
+def wait_for_event(timeout):
+    # wait (really wait, even on a virtual clock) for something to show up in the event
+    # queue, returns None if nothing did
+    try:
+        return _events.get(timeout=timeout)
+    except queue.Empty:
+        return None
+
+
+# the function used to sleep, replaced when running on a virtual clock
+_wait = wait_for_event
+
+
+def set_waiter(wait_func):
+    # replace the function used to sleep, wait_func(timeout) returns an event or None
+    global _wait
+    _wait = wait_func if wait_func is not None else wait_for_event
+
+
+def set_tick(tick_func):
+    # call tick_func (with no arguments, from the thread that's waiting) at least every MAX_SLEEP
+    # seconds while wait_until waits; the controller uses it to keep its heartbeat going. None stops it
+    global _tick
+    _tick = tick_func
+
+
+def post(event_type, data=None):
+    # post an event to the queue, waking up the scheduler
+    _events.put((event_type, data))
+
+
+def next_event_time(event_times, now):
+    # returns the (aware, UTC) datetime of the next occurrence (after now, an aware UTC datetime)
+    # of any of the (local) times in event_times (24 hour format, 700 = 7:00 AM), or None if
+    # there aren't any
+    # (times that aren't valid, like 1375, will never happen, so they're skipped)
+    times = sorted(set(event_time for event_time in event_times
+                       if 0 <= event_time and event_time // 100 <= 23 and event_time % 100 <= 59))
+    if not times:
+        return None
+    local_now = tz_table.to_local(now)
+    today = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
+    # local times map to UTC in the same order (a skipped time maps to the moment the clock
+    # jumped, a repeated one to its first occurrence), so the first time after the current
+    # minute that's still ahead of us is the next one
+    start = bisect_right(times, local_now.hour * 100 + local_now.minute)
+    for day, candidates in ((today, times[start:]), (today + timedelta(days=1), times)):
+        for event_time in candidates:
+            candidate = tz_table.to_utc(day.replace(hour=int(event_time // 100), minute=int(event_time % 100)))
+            if candidate > now:
+                return candidate
+    return None
+
+
+def wait_until(deadline):
+    # sleep until the (aware, UTC) deadline or until an event shows up in the queue
+    # returns the event that woke us up:
+    #   (EVENT_TIMER, deadline) - we reached the deadline
+    #   (EVENT_CLOCK_JUMP, seconds) - the wall clock moved by this many seconds while we slept
+    #   or whatever was posted to the event queue
+    global wakeups
+    global clock_jumps
+
+    while 1:
+        plan_wall = clock.utcnow()
+        plan_mono = clock.monotonic()
+        if deadline is None:
+            delay = MAX_SLEEP
+        else:
+            delay = (deadline - plan_wall).total_seconds()
+            if delay <= 0:
+                return EVENT_TIMER, deadline
+        event = _wait(min(delay, MAX_SLEEP))
+        wakeups += 1
+        if event is not None:
+            return event
+        # did the wall clock move differently than the monotonic clock while we were asleep?
+        drift = (clock.utcnow() - plan_wall).total_seconds() - (clock.monotonic() - plan_mono)
+        if abs(drift) > JUMP_TOLERANCE:
+            clock_jumps += 1
+            return EVENT_CLOCK_JUMP, drift
+        # otherwise, we either made it to the deadline (handled at the top of the loop) or
+        # we hit MAX_SLEEP and have to go back to sleep
+        if _tick is not None:
+            _tick()
+
+
+if __name__ == "__main__":
+    # Simulate a day on a virtual clock and count how many times the scheduler wakes up
+    try:
+        times = [700, 900, 1700, 1743, 1812, 1855, 1930, 2300, 1]
+        start = datetime(2026, 1, 15, 0, 0, 30)
+        virtual_clock = clock.VirtualClock(start)
+        virtual_clock.install()
+
+
+        def virtual_wait(timeout):
+            virtual_clock.advance(timeout)
+            return None
+
+
+        set_waiter(virtual_wait)
+        fired = 0
+        while clock.now() < start + timedelta(days=1):
+            event_type, data = wait_until(next_event_time(times, clock.utcnow()))
+            if event_type == EVENT_TIMER:
+                fired += 1
+        print("Transitions fired:", fired)
+        print("Scheduler wakeups per day:", wakeups)
+        print("Polling loop wakeups per day:", int(24 * 60 * 60 / .25))
+    except KeyboardInterrupt:
+        print("\nExiting application\n")
+        sys.exit(0)
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Shared State
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Publishes the controller's state to a memory mapped file (in /dev/shm, so it's only ever in memory) for
+#    other programs to read with shm_reader.py. The layout is described in shm_reader.py. Everything's updated
+#    in place: the file's created (or reused, so readers don't have to reopen it when the controller restarts)
+#    once, then each update just writes the fields that changed between two bumps of the sequence number.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import mmap
+import os
+import struct
+
+import log
+from shm_reader import (CHANNEL, CHANNEL_OFFSET, CHANNEL_SIZE, MAGIC, MAX_CHANNELS, MAX_WINDOWS, PREFIX, SCHEDULE,
+                        SCHEDULE_OFFSET, SEQUENCE, SEQUENCE_OFFSET, SIZE, STATUS, STATUS_OFFSET, VERSION)
+
+
+def _mask(values):
+    # turns a list of True/False values into a bit mask (the first value is bit 0)
+    result = 0
+    for channel, value in enumerate(values[:MAX_CHANNELS]):
+        if value:
+            result |= 1 << channel
+    return result
+
+
+class SharedState(object):
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != SIZE:
+                os.ftruncate(fd, SIZE)
+            self._map = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        # if the file's from an earlier run, keep counting from its sequence number, so
+        # readers that still have it open see a change
+        magic, version = PREFIX.unpack_from(self._map)
+        self._sequence = 0
+        if magic == MAGIC and version == VERSION:
+            sequence = SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+            self._sequence = sequence + (sequence & 1)
+        PREFIX.pack_into(self._map, 0, MAGIC, VERSION)
+        self._status = None
+        self._updated = 0.0
+
+    def _begin(self):
+        self._sequence += 1
+        SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, self._sequence)
+
+    def _end(self):
+        self._sequence += 1
+        SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, self._sequence)
+
+    def write_status(self, statuses, scheduled, overridden, heartbeat):
+        # statuses, scheduled and overridden are lists of True/False values (one per relay),
+        # heartbeat is the current (UNIX) time
+        status = (_mask(statuses), _mask(scheduled), _mask(overridden))
+        if status != self._status:
+            self._status = status
+            self._updated = heartbeat
+        self._begin()
+        STATUS.pack_into(self._map, STATUS_OFFSET, self._updated, heartbeat, *status)
+        self._end()
+
+    def write_schedule(self, day, sunrise, sunset, pins, daily_slots):
+        # day is a date, sunrise and sunset are 24 hour format times, pins and daily_slots have
+        # one entry per relay (daily_slots' windows are (on, off) times, 24 hour format)
+        if len(pins) > MAX_CHANNELS:
+            log.warning("Too many relays for the shared state file, leaving some out", relays=len(pins))
+        self._begin()
+        SCHEDULE.pack_into(self._map, SCHEDULE_OFFSET, day.year * 10000 + day.month * 100 + day.day,
+                           sunrise, sunset, min(len(pins), MAX_CHANNELS))
+        for channel, (pin, windows) in enumerate(zip(pins[:MAX_CHANNELS], daily_slots)):
+            if len(windows) > MAX_WINDOWS:
+                log.warning("Too many windows for the shared state file, leaving some out", relay=channel,
+                            windows=len(windows))
+                windows = windows[:MAX_WINDOWS]
+            offset = CHANNEL_OFFSET + channel * CHANNEL_SIZE
+            CHANNEL.pack_into(self._map, offset, pin, len(windows))
+            struct.pack_into("<%dH" % (2 * len(windows)), self._map, offset + CHANNEL.size,
+                             *[minute for window in windows for minute in window])
+        self._end()
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,196 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Shared State Reader
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    The controller publishes its state (which relays are on, today's on/off windows, the sunrise and sunset
+#    times and a heartbeat) to a small memory mapped file, /dev/shm/pi-relay-timer by default. Dashboards and
+#    watchdog scripts can read it as often as they like: once the file's mapped, reading it is just reading
+#    memory, no sockets or system calls, and the controller never has to wait for them.
+#
+#    The file has a fixed layout (below). The controller adds 1 to the sequence number before it changes
+#    anything and 1 again when it's done, so the sequence number is odd while it's writing; a reader copies
+#    what it needs and checks that the sequence number didn't change (and wasn't odd) while it was copying.
+#    This module only uses the standard library, copy it to wherever your scripts are. Use it like this:
+#
+#        reader = shm_reader.Reader()
+#        state = reader.read()
+#        print(state["relays"][0]["on"])
+#
+#    or run it directly to see the current state (add --watch to keep watching it).
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from datetime import datetime
+
+# where the controller puts its state
+DEFAULT_PATH = "/dev/shm/pi-relay-timer"
+
+# The file's layout (all numbers are little endian):
+#
+#   offset  size  field
+#    0      4     magic number, b"PRLY"
+#    4      2     layout version
+#    8      8     sequence number, odd while the controller's writing
+#   16      8     updated, the last time any of the relays changed (UNIX time)
+#   24      8     heartbeat, the last time the controller updated the file (UNIX time), at least
+#                 every 5 minutes (scheduler.MAX_SLEEP) even when it's got nothing to do
+#   32      4     the relays that are on (bit 0 is relay 0)
+#   36      4     the relays the schedule says are supposed to be on
+#   40      4     the relays that are overridden
+#   44      4     the day the schedule's for (20261018)
+#   48      2     sunrise (24 hour format, 645 = 6:45 AM)
+#   50      2     sunset
+#   52      2     the number of relays
+#   56            a block for each relay (MAX_CHANNELS of them):
+#                   2  its GPIO pin
+#                   2  the number of on/off windows it has today
+#                   4 * MAX_WINDOWS  the windows, (on, off) in 24 hour format
+MAGIC = b"PRLY"
+VERSION = 1
+MAX_CHANNELS = 32
+MAX_WINDOWS = 128
+PREFIX = struct.Struct("<4sH2x")
+SEQUENCE = struct.Struct("<Q")
+SEQUENCE_OFFSET = 8
+STATUS = struct.Struct("<ddIII")
+STATUS_OFFSET = 16
+SCHEDULE = struct.Struct("<IHHH2x")
+SCHEDULE_OFFSET = 44
+HEADER = struct.Struct("<4sH2xQddIIIIHHH2x")
+CHANNEL = struct.Struct("<HH")
+CHANNEL_OFFSET = HEADER.size
+CHANNEL_SIZE = CHANNEL.size + 4 * MAX_WINDOWS
+SIZE = CHANNEL_OFFSET + MAX_CHANNELS * CHANNEL_SIZE
+
+# how many times to try to get a clean copy before giving up
+READ_TRIES = 100
+
+
+class Reader(object):
+    # Reads the controller's state. Raises IOError if the file isn't there, or ValueError
+    # if it isn't a state file (or is from a different version of the controller)
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        with open(path, "rb") as state_file:
+            if os.fstat(state_file.fileno()).st_size != SIZE:
+                raise ValueError("%s isn't a relay controller state file" % path)
+            self._map = mmap.mmap(state_file.fileno(), SIZE, access=mmap.ACCESS_READ)
+        magic, version = PREFIX.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError("%s isn't a (version %d) relay controller state file" % (path, VERSION))
+
+    def sequence(self):
+        # returns the sequence number. It changes every time the controller writes anything,
+        # so polling this (and only reading the rest when it changes) is as cheap as it gets
+        return SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+
+    def _copy(self, size):
+        # returns a clean copy of the first size bytes, or None if the controller kept writing
+        for i in range(READ_TRIES):
+            before = SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+            if before & 1:
+                # it's writing, give it a chance to finish
+                time.sleep(0)
+                continue
+            data = self._map[:size]
+            if SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0] == before:
+                return data
+        return None
+
+    def read_status(self):
+        # returns the header fields (everything but the windows) as a dictionary, or None if
+        # the controller's in the middle of writing (try again)
+        data = self._copy(HEADER.size)
+        if data is None:
+            return None
+        (magic, version, sequence, updated, heartbeat, on, scheduled, overridden, day, sunrise, sunset,
+         num_channels) = HEADER.unpack(data)
+        return {
+            "sequence": sequence,
+            "updated": updated,
+            "heartbeat": heartbeat,
+            "day": day,
+            "sunrise": sunrise,
+            "sunset": sunset,
+            "relays": [{"relay": channel, "on": bool(on >> channel & 1),
+                        "scheduled": bool(scheduled >> channel & 1),
+                        "overridden": bool(overridden >> channel & 1)} for channel in range(num_channels)],
+        }
+
+    def read(self):
+        # returns everything (read_status, plus each relay's pin and daily_slots), or None if
+        # the controller's in the middle of writing (try again)
+        data = self._copy(SIZE)
+        if data is None:
+            return None
+        header = HEADER.unpack_from(data)
+        state = {"sequence": header[2], "updated": header[3], "heartbeat": header[4], "day": header[8],
+                 "sunrise": header[9], "sunset": header[10], "relays": []}
+        for channel in range(header[11]):
+            offset = CHANNEL_OFFSET + channel * CHANNEL_SIZE
+            pin, count = CHANNEL.unpack_from(data, offset)
+            values = struct.unpack_from("<%dH" % (2 * count), data, offset + CHANNEL.size)
+            state["relays"].append({
+                "relay": channel,
+                "pin": pin,
+                "on": bool(header[5] >> channel & 1),
+                "scheduled": bool(header[6] >> channel & 1),
+                "overridden": bool(header[7] >> channel & 1),
+                "daily_slots": list(zip(values[::2], values[1::2])),
+            })
+        return state
+
+    def close(self):
+        self._map.close()
+
+
+def show(state):
+    # print the state in a (more or less) readable form
+    print("Day %d, sunrise %04d, sunset %04d, heartbeat %s (sequence %d)" % (
+        state["day"], state["sunrise"], state["sunset"],
+        datetime.fromtimestamp(state["heartbeat"]).isoformat(timespec="seconds"), state["sequence"]))
+    for relay_state in state["relays"]:
+        print("Relay %d (pin %d): %s%s%s" % (
+            relay_state["relay"], relay_state["pin"], "ON" if relay_state["on"] else "OFF",
+            ", scheduled " + ("ON" if relay_state["scheduled"] else "OFF"),
+            ", overridden" if relay_state["overridden"] else ""))
+        print("  " + " ".join("%04d-%04d" % window for window in relay_state["daily_slots"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show a running controller's state")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="the controller's state file")
+    parser.add_argument("--watch", action="store_true", help="keep watching for changes")
+    parser.add_argument("--interval", type=float, default=0.1, help="how often (in seconds) to check for changes")
+    args = parser.parse_args()
+    reader = Reader(args.path)
+    last = None
+    while 1:
+        sequence = reader.sequence()
+        if sequence != last:
+            state = reader.read()
+            if state is not None:
+                last = state["sequence"]
+                show(state)
+        if not args.watch:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nExiting application\n")
+        sys.exit(0)
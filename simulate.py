@@ -0,0 +1,330 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Simulator
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Runs the controller on a virtual clock and GPIO Zero's mock pins, so you can see what a whole year of your
+#    schedule looks like in a few seconds (including daylight saving time changes). It prints how long each relay
+#    was on each day and can save a log of every relay transition. Use it to check a schedule before you deploy
+#    it, or to see how fast the scheduling engine is.
+#
+#    Usage: python simulate.py [--days 365] [--start 2026-01-01] [--zone America/New_York] [--seed 1] [--log file]
+#
+#    Add --stall 5 to make the controller stall (oversleep by 5 minutes) every so often, and check that it
+#    still runs every on/off window it would have run without the stalls. Run it with --dst to check that the
+#    relays go on and off when they're supposed to across New York's 2026 daylight saving time changes. Either
+#    check exits with status 1 if it fails.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+# use mock pins, so we don't need real hardware
+os.environ.setdefault("GPIOZERO_PIN_FACTORY", "mock")
+
+import clock
+import controller
+import log
+import metrics
+import relay
+import scheduler
+from slot import SETTIME, Slot
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
+
+
+# with --stall, the controller stalls once every this many times it wakes up for something
+STALL_EVERY = 7
+
+# the schedule --dst runs, a (pin, [(on, off) times, 24 hour format]) entry for each relay: a window in the
+# hour that repeats when daylight saving time ends (and one covering all of it), one in the hour that's
+# skipped when it starts, and one that starts in the skipped hour
+DST_CHANNELS = [(18, [(115, 145)]), (23, [(230, 400)]), (24, [(215, 245)]), (25, [(100, 200)])]
+# the timezone and days --dst runs, and when (UTC) each relay is supposed to be on during each day
+DST_ZONE = "America/New_York"
+DST_CHECKS = [
+    # the clock jumps from 2:00 to 3:00 AM (7:00 UTC), so 2:15 to 2:45 never happens, and 2:30 to 4:00
+    # starts at 3:00
+    (datetime(2026, 3, 8), [[(datetime(2026, 3, 8, 6, 15), datetime(2026, 3, 8, 6, 45))],
+                            [(datetime(2026, 3, 8, 7, 0), datetime(2026, 3, 8, 8, 0))],
+                            [],
+                            [(datetime(2026, 3, 8, 6, 0), datetime(2026, 3, 8, 7, 0))]]),
+    # 1:00 to 1:59 AM happens twice (from 5:00 and from 6:00 UTC), the relays only run it once
+    (datetime(2026, 11, 1), [[(datetime(2026, 11, 1, 5, 15), datetime(2026, 11, 1, 5, 45))],
+                             [(datetime(2026, 11, 1, 7, 30), datetime(2026, 11, 1, 9, 0))],
+                             [(datetime(2026, 11, 1, 7, 15), datetime(2026, 11, 1, 7, 45))],
+                             [(datetime(2026, 11, 1, 5, 0), datetime(2026, 11, 1, 7, 0))]]),
+]
+# how often (in minutes) --dst wakes the controller up with a status request, like a dashboard would
+DST_POLL = 5
+
+
+class StopSimulation(Exception):
+    # raised when the virtual clock reaches the end of the simulation
+    pass
+
+
+def run(days, start, zone=None, seed=None, verbose=False, stall=0, stalls=None, channels=None, poll=0):
+    # runs the controller for the number of days starting at start (a naive local datetime)
+    # returns the virtual clock and the list of transitions (seconds, local time, channel, status)
+    # stall is the number of minutes the controller stalls (oversleeps) by every STALL_EVERY
+    # times it wakes up for something, each stall's (start, end) seconds get added to the stalls list.
+    # channels replaces the schedule (the schedule file's, or controller.py's), and with poll, a
+    # control server status request wakes the controller up every poll minutes
+    transitions = []
+    virtual_clock = clock.VirtualClock(start, zone)
+    end = start + timedelta(days=days)
+    waits = [0]
+    next_poll = [poll * 60]
+
+    def virtual_wait(timeout):
+        # instead of sleeping, move the virtual clock forward
+        if virtual_clock.now() >= end:
+            raise StopSimulation()
+        if poll and virtual_clock.monotonic() + timeout >= next_poll[0]:
+            virtual_clock.advance(next_poll[0] - virtual_clock.monotonic())
+            next_poll[0] += poll * 60
+            return controller.EVENT_CONTROL, ({"cmd": "status"}, lambda response: None)
+        virtual_clock.advance(timeout)
+        if stall and timeout < scheduler.MAX_SLEEP:
+            # it woke up for something, stall every so often
+            waits[0] += 1
+        if stall and timeout < scheduler.MAX_SLEEP and waits[0] % STALL_EVERY == 0:
+            stalled_at = virtual_clock.monotonic()
+            virtual_clock.advance(stall * 60)
+            if stalls is not None:
+                stalls.append((stalled_at, virtual_clock.monotonic()))
+        return None
+
+    def record(channel, status):
+        transitions.append((virtual_clock.monotonic(), virtual_clock.now(), channel, status))
+
+    controller.seed_random(seed)
+    virtual_clock.install()
+    scheduler.set_waiter(virtual_wait)
+    controller.SOLAR_SOURCE = "local"
+    # the simulation builds its own schedule, and leaves the controller's snapshot alone
+    controller.USE_SNAPSHOT = False
+    out = sys.stdout
+    try:
+        if not verbose:
+            # the controller talks a lot, keep it quiet
+            sys.stdout = open(os.devnull, "w")
+        # simulate the schedule the controller would run (or the one we were given)
+        if channels is None:
+            controller.load_schedule()
+        else:
+            controller.channels = channels
+        controller.init_hardware()
+        relay.bank.listeners.append(record)
+        if not controller.validate_slots():
+            raise ValueError("Invalid slot(s) definition")
+        controller.init_app()
+        controller.process_loop()
+    except StopSimulation:
+        pass
+    finally:
+        # write out what the simulation logged while the output's still quiet
+        log.flush()
+        if sys.stdout is not out:
+            sys.stdout.close()
+            sys.stdout = out
+        scheduler.set_waiter(None)
+        clock.reset_clock()
+    return virtual_clock, transitions
+
+
+def on_time_totals(virtual_clock, transitions, start, days, num_channels):
+    # returns a list with a (date, [minutes on for each channel]) tuple for each day
+    # the days are measured on the monotonic clock, so 23 and 25 hour days (daylight
+    # saving time changes) come out right
+    boundaries = [virtual_clock.seconds_at(start + timedelta(days=i)) for i in range(days + 1)]
+    totals = [[0.0] * num_channels for i in range(days)]
+    on_since = [None] * num_channels
+    events = list(transitions) + [(boundaries[-1], None, channel, False) for channel in range(num_channels)]
+    for seconds, local_time, channel, status in events:
+        if status and on_since[channel] is None:
+            on_since[channel] = seconds
+        elif not status and on_since[channel] is not None:
+            # split the on time up across the days it covers
+            for day in range(days):
+                overlap = min(seconds, boundaries[day + 1]) - max(on_since[channel], boundaries[day])
+                if overlap > 0:
+                    totals[day][channel] += overlap / 60
+            on_since[channel] = None
+    return [((start + timedelta(days=day)).date(), totals[day]) for day in range(days)]
+
+
+def on_windows(transitions, num_channels):
+    # returns a list (one per channel) of the (on, off) seconds of each time the relay was on
+    result = [[] for channel in range(num_channels)]
+    on_since = [None] * num_channels
+    for seconds, local_time, channel, status in transitions:
+        if status and on_since[channel] is None:
+            on_since[channel] = seconds
+        elif not status and on_since[channel] is not None:
+            result[channel].append((on_since[channel], seconds))
+            on_since[channel] = None
+    return result
+
+
+def missed_windows(expected, actual, stalls):
+    # returns the number of on windows in expected (from on_windows) that never happened in actual,
+    # and how many of those were entirely inside a stall (so there was no way to run them)
+    missed = 0
+    inside = 0
+    for expected_windows, actual_windows in zip(expected, actual):
+        for on, off in expected_windows:
+            # the stalls make windows late, so anything that overlaps it (or starts during a stall
+            # that overlaps it) counts
+            late_off = max([off] + [stall_end for stall_start, stall_end in stalls if stall_start < off <= stall_end])
+            if not any(start < late_off and on <= stop for start, stop in actual_windows):
+                missed += 1
+                if any(stall_start <= on and off <= stall_end for stall_start, stall_end in stalls):
+                    inside += 1
+    return missed, inside
+
+
+def is_on(windows, seconds):
+    # returns True if seconds is inside one of the (sorted) on windows
+    index = bisect_right(windows, (seconds, float("inf"))) - 1
+    return index >= 0 and windows[index][0] <= seconds < windows[index][1]
+
+
+def wrong_minutes(expected, actual, stalls, start, end):
+    # returns the number of minutes (from start to end, in seconds) the relays spent somewhere other
+    # than where they were expected to be, not counting the stalls (nothing can happen during those)
+    wrong = 0
+    for expected_windows, actual_windows in zip(expected, actual):
+        for seconds in range(int(start) + 30, int(end), 60):
+            if is_on(expected_windows, seconds) != is_on(actual_windows, seconds) and not is_on(stalls, seconds):
+                wrong += 1
+    return wrong
+
+
+def check_dst(verbose=False):
+    # run DST_CHANNELS through each of the DST_CHECKS days (with a status request every DST_POLL
+    # minutes), returns a list of what went wrong (an empty list if nothing did)
+    zone = ZoneInfo(DST_ZONE)
+    channels = [(pin, [Slot(SETTIME, on, SETTIME, off) for on, off in windows]) for pin, windows in DST_CHANNELS]
+    failures = []
+    for day, expected in DST_CHECKS:
+        virtual_clock, transitions = run(1, day, zone, 1, verbose, channels=channels, poll=DST_POLL)
+        start = virtual_clock.start.replace(tzinfo=None)
+        for channel, windows in enumerate(on_windows(transitions, len(channels))):
+            actual = [(start + timedelta(seconds=on), start + timedelta(seconds=off)) for on, off in windows]
+            if actual != expected[channel]:
+                failures.append("%s relay %d was on %s (UTC), it should have been on %s" % (
+                    day.date(), channel, [(on.strftime("%H:%M"), off.strftime("%H:%M")) for on, off in actual],
+                    [(on.strftime("%H:%M"), off.strftime("%H:%M")) for on, off in expected[channel]]))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the relay controller on a virtual clock")
+    parser.add_argument("--days", type=int, default=365, help="number of days to simulate")
+    parser.add_argument("--start", default=datetime.now().strftime("%Y-%m-%d"), help="first day (YYYY-MM-DD)")
+    parser.add_argument("--zone", default=None, help="timezone to simulate, e.g. America/New_York")
+    parser.add_argument("--seed", type=int, default=1, help="random number generator seed")
+    parser.add_argument("--log", default=None, help="save the transition log to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the controller's output")
+    parser.add_argument("--stall", type=int, default=0,
+                        help="make the controller stall for this many minutes every %d times it wakes up" % STALL_EVERY)
+    parser.add_argument("--dst", action="store_true",
+                        help="check the relays across %s's daylight saving time changes, then exit" % DST_ZONE)
+    args = parser.parse_args()
+
+    if args.dst:
+        if ZoneInfo is None:
+            print("Timezones need Python 3.9 or later")
+            sys.exit(1)
+        failures = check_dst(args.verbose)
+        if failures:
+            print("\nDaylight saving time check failed:\n" + "\n".join(failures))
+            sys.exit(1)
+        print("\nThe relays run their windows once, at the right times, across both daylight saving time changes")
+        return
+
+    zone = None
+    if args.zone:
+        if ZoneInfo is None:
+            print("Timezones need Python 3.9 or later")
+            sys.exit(1)
+        # make the rest of the application (solar calculations) use the same timezone
+        os.environ["TZ"] = args.zone
+        time.tzset()
+        zone = ZoneInfo(args.zone)
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+
+    started = time.time()
+    virtual_clock, transitions = run(args.days, start, zone, args.seed, args.verbose)
+    elapsed = time.time() - started
+
+    num_channels = len(controller.channels)
+    print("\nDate        " + " ".join("Relay %-3d" % channel for channel in range(num_channels)))
+    for day, totals in on_time_totals(virtual_clock, transitions, start, args.days, num_channels):
+        print(day.isoformat() + "  " + " ".join("%9.0f" % minutes for minutes in totals))
+
+    if args.log:
+        with open(args.log, "w") as log_file:
+            log_file.write("time,relay,status\n")
+            for seconds, local_time, channel, status in transitions:
+                log_file.write("%s,%d,%s\n" % (local_time.isoformat(), channel, "ON" if status else "OFF"))
+        print("\nTransition log saved to", args.log)
+
+    print("\nSimulated %d days in %.2f seconds (%.0f days per second)" %
+          (args.days, elapsed, args.days / elapsed if elapsed else 0))
+    print("Transitions:", len(transitions))
+    print("Scheduler wakeups:", scheduler.wakeups)
+    print("Clock jumps:", scheduler.clock_jumps)
+
+    if args.stall:
+        # run it again with the stalls, and see if it missed any of the windows (the run without
+        # them shouldn't have reported any)
+        healthy_stalls = metrics.get("loop_stalls_total")
+        stalls = []
+        started = time.time()
+        stalled_clock, stalled_transitions = run(args.days, start, zone, args.seed, args.verbose, args.stall, stalls)
+        elapsed = time.time() - started
+        detected = metrics.get("loop_stalls_total") - healthy_stalls
+        expected = on_windows(transitions, num_channels)
+        missed, inside = missed_windows(expected, on_windows(stalled_transitions, num_channels), stalls)
+        wrong = wrong_minutes(expected, on_windows(stalled_transitions, num_channels), stalls,
+                              stalled_clock.seconds_at(start), stalled_clock.seconds_at(start + timedelta(days=args.days)))
+        print("\nSimulated %d days with %d %d minute stalls in %.2f seconds" % (
+            args.days, len(stalls), args.stall, elapsed))
+        print("Stalls detected: %d (%d without the stalls)" % (detected, healthy_stalls))
+        print("On windows:", sum(len(windows) for windows in expected))
+        print("Windows missed: %d (%d of them were entirely inside a stall)" % (missed, inside))
+        print("Minutes a relay was in the wrong state (outside the stalls):", wrong)
+        failures = []
+        if healthy_stalls:
+            failures.append("%d stalls reported without any stalls" % healthy_stalls)
+        if args.stall * 60 > controller.STALL_TIME and detected != len(stalls):
+            failures.append("%d of %d stalls reported" % (detected, len(stalls)))
+        if missed > inside:
+            failures.append("%d windows missed outside the stalls" % (missed - inside))
+        if wrong:
+            failures.append("%d minutes in the wrong state outside the stalls" % wrong)
+        if failures:
+            print("\nStall check failed: " + ", ".join(failures))
+            sys.exit(1)
+        print("\nStall check passed")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nExiting application\n")
+        sys.exit(0)
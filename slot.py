@@ -0,0 +1,53 @@
+# *****************************************************************************************************************
+#    Pi Power Controller - Slots
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    A slot defines a time window for a relay: when it turns on, when it turns off, and whether it turns on and
+#    off randomly in between. This module has no dependencies (no NumPy), so the controller can load it (and get
+#    the relays into a safe state) as quickly as possible at startup.
+# ********************************************************************************************************************
+
+# 'constants' that define the different time triggers used by the application
+# DO NOT MODIFY THESE, you'll mess up the app's logic
+SETTIME = -1
+SUNRISE = -2
+SUNSET = -3
+
+
+class Slot(object):
+    # A single time window. The trigger values are SETTIME, SUNRISE or SUNSET. For SETTIME, the
+    # value is the time (24 hour format, 700 = 7:00 AM); for SUNRISE and SUNSET it's the number of
+    # minutes before (negative) or after (positive) sunrise or sunset. For random slots,
+    # min_minutes and max_minutes are the shortest and longest (in minutes) the relay stays
+    # on, or off, at a time
+    __slots__ = ("on_trigger", "on_value", "off_trigger", "off_value", "do_random", "min_minutes", "max_minutes")
+
+    def __init__(self, on_trigger, on_value, off_trigger, off_value, do_random=False, min_minutes=5, max_minutes=60):
+        self.on_trigger = int(on_trigger)
+        self.on_value = int(on_value)
+        self.off_trigger = int(off_trigger)
+        self.off_value = int(off_value)
+        self.do_random = bool(do_random)
+        self.min_minutes = int(min_minutes)
+        self.max_minutes = int(max_minutes)
+
+    def uses_solar_data(self):
+        # returns True if the slot uses sunrise or sunset
+        return self.on_trigger < SETTIME or self.off_trigger < SETTIME
+
+    def __eq__(self, other):
+        return isinstance(other, Slot) and self.as_tuple() == other.as_tuple()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def as_tuple(self):
+        return (self.on_trigger, self.on_value, self.off_trigger, self.off_value, self.do_random, self.min_minutes,
+                self.max_minutes)
+
+    def __repr__(self):
+        return "Slot(%d, %d, %d, %d, %s, %d, %d)" % self.as_tuple()
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Daily Snapshot
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Saves the day's schedule (the on/off times generated for each slot, random ones included, and the sunrise
+#    and sunset times they came from) to a small JSON file, so a controller that restarts part way through the
+#    day (after a crash or a power failure) picks up the same schedule it had, instead of rolling a new one:
+#
+#    {"date": "2026-10-18", "sunrise": 731, "sunset": 1846,
+#     "channels": [[[[-1, 1700, -1, 2300, true], [[1700, 1722], [1745, 1802]]], ...], ...]}
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import json
+import os
+
+import log
+from slot import Slot
+
+# where the snapshot lives
+SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot.json")
+
+
+def save(day, sunrise, sunset, slot_windows, path=None):
+    # save the day's schedule; slot_windows is a list (one per channel) of (slot, on/off times) pairs.
+    # The data goes to a temporary file first, then replaces the snapshot, so a power failure
+    # never leaves a half written snapshot behind
+    path = path or SNAPSHOT_FILE
+    data = {
+        "date": day.isoformat(),
+        "sunrise": sunrise,
+        "sunset": sunset,
+        "channels": [[[list(slot.as_tuple()), windows] for slot, windows in pairs] for pairs in slot_windows],
+    }
+    temp_file = path + ".tmp"
+    try:
+        with open(temp_file, "w") as snapshot_file:
+            json.dump(data, snapshot_file, separators=(",", ":"))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_file, path)
+    except (IOError, OSError) as e:
+        log.warning("Unable to save snapshot", error=e)
+
+
+def load(day, path=None):
+    # returns the (sunrise, sunset, slot_windows) saved for the day, or None if there
+    # isn't a snapshot for the day (or it's no good)
+    path = path or SNAPSHOT_FILE
+    try:
+        with open(path) as snapshot_file:
+            data = json.load(snapshot_file)
+        if data["date"] != day.isoformat():
+            return None
+        slot_windows = [[(Slot(*slot), [[int(on_time), int(off_time)] for on_time, off_time in windows])
+                         for slot, windows in pairs] for pairs in data["channels"]]
+        return int(data["sunrise"]), int(data["sunset"]), slot_windows
+    except (IOError, OSError):
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        log.warning("Ignoring invalid snapshot", error=e)
+        return None
@@ -0,0 +1,304 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Solar API Client
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Gets sunrise and sunset times from the Sunrise Sunset web service (http://sunrise-sunset.org/api). Requests
+#    run on a background thread, share a single HTTP session (so connections get reused), give up after a hard
+#    timeout and retry with exponential backoff, so a slow or hung server never stalls the controller. Several
+#    days are fetched at once (in parallel) and saved in the solar data cache, so the controller can keep going
+#    for weeks without a network connection. Run python solar_api.py --check to check the timeouts, retries and
+#    error handling against stand-in servers that fail, stall and hang.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import requests
+
+import log
+import metrics
+import solar_cache
+
+# API for determining sunrise and sunset times: http://sunrise-sunset.org/api
+# Test URL to retrieve data for Charlotte, NC US
+# Usage: http://api.sunrise-sunset.org/json?lat=35.2271&lng=-80.8431&date=today
+SOLAR_API_URL = "http://api.sunrise-sunset.org/json"
+
+# how long (in seconds) to wait for the server to connect, then to respond
+TIMEOUT = (5, 10)
+# how many times to try before giving up
+RETRIES = 5
+# how long (in seconds) to wait before the first retry, this doubles every retry
+BACKOFF = 2
+# the longest (in seconds) we'll wait between retries
+MAX_BACKOFF = 300
+# how many requests to run at the same time when fetching several days
+WORKERS = 4
+
+# the HTTP session shared by all requests
+_session = None
+# the background thread currently fetching data (if there is one)
+_worker = None
+_lock = threading.Lock()
+
+
+def get_session():
+    # returns the shared HTTP session, creating it the first time through
+    global _session
+
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def fetch(lat, lng, day="today", url=None):
+    # get the solar data for the day from the web service, retrying as needed
+    # returns the results object from the API's response (sunrise and sunset are strings,
+    # in UTC time, formatted like "7:27:02 AM") or None if we couldn't get it
+    if url is None:
+        url = SOLAR_API_URL
+    payload = {"lat": lat, "lng": lng, "date": day}
+    delay = BACKOFF
+    for attempt in range(RETRIES):
+        if attempt > 0:
+            log.info("Retrying solar data request", delay=delay)
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_BACKOFF)
+        started = time.perf_counter()
+        try:
+            res = get_session().get(url, params=payload, timeout=TIMEOUT)
+            # did we get a result?
+            if res.status_code == requests.codes.ok:
+                data = res.json()
+                # the service answers errors (a bad location, say) with a status and no results
+                if data["status"] == "OK" and isinstance(data["results"], dict):
+                    metrics.observe("solar_fetch_seconds", time.perf_counter() - started)
+                    return data["results"]
+                log.warning("Unable to obtain solar data", status=data["status"])
+            else:
+                log.warning("Unable to obtain solar data", status=res.status_code)
+        except requests.exceptions.Timeout:
+            log.warning("Solar data request timed out")
+        except requests.exceptions.RequestException as e:
+            log.warning("Solar data request failed", error=e)
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning("Invalid solar data", error=e)
+        metrics.inc("solar_fetch_failures_total")
+    return None
+
+
+def parse_time(time_str):
+    # converts a time string from the API ("7:27:02 AM") to 24 hour format (727)
+    time_val = datetime.strptime(time_str, "%I:%M:%S %p")
+    return time_val.hour * 100 + time_val.minute
+
+
+def prefetch(lat, lng, days, start=None, url=None):
+    # make sure the solar data cache has the location's sunrise and sunset times for
+    # the given number of days, starting with start (defaults to today). Days that are
+    # already in the cache aren't requested again. Returns the number of days fetched
+    if start is None:
+        start = date.today()
+    missing = [start + timedelta(days=i) for i in range(days)]
+    missing = [day for day in missing if solar_cache.get(lat, lng, day) is None]
+    if missing:
+        log.info("Requesting solar data", days=len(missing))
+    fetched = 0
+    executor = ThreadPoolExecutor(max_workers=WORKERS)
+    try:
+        for day, results in zip(missing, executor.map(lambda d: fetch(lat, lng, d.isoformat(), url), missing)):
+            if results is None:
+                continue
+            try:
+                solar_cache.put(lat, lng, day, parse_time(results['sunrise']), parse_time(results['sunset']))
+                fetched += 1
+            except (ValueError, KeyError, TypeError) as e:
+                log.warning("Invalid solar data", day=day, error=e)
+    finally:
+        executor.shutdown()
+    # throw away the old stuff, then save whatever changed
+    if solar_cache.evict(start) or fetched:
+        solar_cache.save()
+    return fetched
+
+
+def prefetch_async(lat, lng, days, callback=None, start=None, url=None):
+    # run prefetch on a background thread, then call callback (if there is one) with the
+    # number of days fetched. Returns False if a request is already running
+    global _worker
+
+    def run():
+        # whatever happens, let the caller know we're done
+        fetched = 0
+        try:
+            fetched = prefetch(lat, lng, days, start, url)
+        except Exception as e:
+            log.error("Solar data request failed", error=repr(e))
+        if callback is not None:
+            callback(fetched)
+
+    with _lock:
+        if _worker is not None and _worker.is_alive():
+            log.debug("Solar data request already running")
+            return False
+        _worker = threading.Thread(target=run, name="solar-api")
+        _worker.daemon = True
+        _worker.start()
+    return True
+
+
+class StubServer(object):
+    # A stand-in for the web service on this computer, for checking the client without a
+    # network. Each request gets the next of the responses it was given: "ok", "slow" (answers
+    # after the client's read timeout), "hang" (never answers), "error" (an HTTP 500) or
+    # "invalid" (the error payload the service sends for a bad request); after that, "ok"
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+        self._stopping = threading.Event()
+        self._server = None
+
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                stub.requests += 1
+                response = stub.responses.pop(0) if stub.responses else "ok"
+                if response == "hang":
+                    stub._stopping.wait()
+                    return
+                if response == "slow":
+                    stub._stopping.wait(TIMEOUT[1] * 2)
+                if response == "error":
+                    self.send_error(500)
+                    return
+                if response == "invalid":
+                    body = {"results": "", "status": "INVALID_REQUEST"}
+                else:
+                    body = {"results": {"sunrise": "11:27:02 AM", "sunset": "10:46:10 PM"}, "status": "OK"}
+                data = json.dumps(body).encode("utf-8")
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (IOError, OSError):
+                    # the client gave up on a slow response
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name="solar-stub")
+        thread.daemon = True
+        thread.start()
+        return "http://127.0.0.1:%d/json" % self._server.server_address[1]
+
+    def stop(self):
+        self._stopping.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def check():
+    # check the client's timeouts, retries and error handling against stand-in servers, raises
+    # AssertionError if it doesn't behave
+    global TIMEOUT
+    global RETRIES
+    global BACKOFF
+    import shutil
+    import tempfile
+
+    # short timeouts and retries, so the check doesn't take all day
+    TIMEOUT = (1, 0.5)
+    RETRIES = 3
+    BACKOFF = 0.05
+    cache_dir = tempfile.mkdtemp()
+    solar_cache.CACHE_FILE = os.path.join(cache_dir, "solar_cache.json")
+    solar_cache.load()
+
+    def run(name, responses, func):
+        stub = StubServer(responses)
+        url = stub.start()
+        started = time.perf_counter()
+        try:
+            result = func(url)
+        finally:
+            stub.stop()
+        elapsed = time.perf_counter() - started
+        print("%-42s %d requests, %.2f seconds" % (name, stub.requests, elapsed))
+        return result, stub.requests, elapsed
+
+    def expect(condition, message):
+        if not condition:
+            raise AssertionError(message)
+
+    try:
+        result, requests_made, elapsed = run("Hung and slow server, gives up", ["hang", "slow", "hang"],
+                                             lambda url: fetch("35.2", "-80.8", "2026-10-18", url))
+        expect(result is None and requests_made == RETRIES, "fetch didn't give up after %d tries" % RETRIES)
+        expect(elapsed < RETRIES * (sum(TIMEOUT) + 1), "fetch didn't time out (%.2f seconds)" % elapsed)
+        result, requests_made, elapsed = run("Failures, then success", ["error", "slow", "ok"],
+                                             lambda url: fetch("35.2", "-80.8", "2026-10-18", url))
+        expect(result is not None and result["sunrise"] == "11:27:02 AM" and requests_made == 3,
+               "fetch didn't retry until it worked")
+        result, requests_made, elapsed = run("Error payloads, gives up", ["invalid"] * RETRIES,
+                                             lambda url: fetch("35.2", "-80.8", "2026-10-18", url))
+        expect(result is None and requests_made == RETRIES, "fetch didn't handle the error payload")
+
+        def prefetch_and_wait(url):
+            done = threading.Event()
+            results = []
+            prefetch_async("35.2", "-80.8", 2, lambda fetched: (results.append(fetched), done.set()),
+                           date(2026, 10, 18), url)
+            expect(done.wait(30), "prefetch_async never called back")
+            return results[0]
+
+        fetched, requests_made, elapsed = run("Background prefetch, error payloads", ["invalid"] * 2 * RETRIES,
+                                              prefetch_and_wait)
+        expect(fetched == 0, "prefetch saved bad data")
+        fetched, requests_made, elapsed = run("Background prefetch, success", [], prefetch_and_wait)
+        expect(fetched == 2 and os.path.exists(solar_cache.CACHE_FILE), "prefetch didn't fill the cache")
+        expect(solar_cache.get("35.2", "-80.8", date(2026, 10, 19)) == (1127, 2246), "wrong times in the cache")
+    finally:
+        shutil.rmtree(cache_dir)
+    print("The solar data client handled everything")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Get today's solar data from the web service")
+    parser.add_argument("--check", action="store_true",
+                        help="check the client against stand-in servers on this computer (no network needed)")
+    args = parser.parse_args()
+    log.FLUSH_LEVEL = log.DEBUG
+    if args.check:
+        check()
+        return
+    print("Requesting solar data from", SOLAR_API_URL)
+    print(fetch("35.227085", "-80.843124"))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nExiting application\n")
+        sys.exit(0)
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Solar Data Cache
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Keeps the solar data the controller downloads in a small JSON file on disk, so it can run for weeks without
+#    a network connection. Times are stored in UTC, in 24 hour format, keyed by location then date:
+#    {"35.227085,-80.843124": {"2026-10-18": [1127, 2246], ...}}
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import json
+import os
+from datetime import timedelta
+
+import log
+
+# where the cache lives
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "solar_cache.json")
+# entries for days more than this many days in the past get thrown away
+MAX_AGE_DAYS = 7
+
+# the cache's contents, loaded from disk the first time we need them
+_cache = None
+
+
+def _location_key(lat, lng):
+    return "%s,%s" % (lat, lng)
+
+
+def load():
+    # load the cache from disk (an empty cache if there isn't one, or it's no good)
+    global _cache
+
+    _cache = {}
+    try:
+        with open(CACHE_FILE) as cache_file:
+            _cache = json.load(cache_file)
+    except (IOError, OSError):
+        pass
+    except ValueError as e:
+        log.warning("Ignoring invalid solar data cache", error=e)
+    return _cache
+
+
+def save():
+    # write the cache to disk; the data goes to a temporary file first, then replaces
+    # the cache file, so a power failure never leaves a half written cache behind
+    temp_file = CACHE_FILE + ".tmp"
+    try:
+        with open(temp_file, "w") as cache_file:
+            json.dump(_cache, cache_file, separators=(",", ":"), sort_keys=True)
+        os.replace(temp_file, CACHE_FILE)
+    except (IOError, OSError) as e:
+        log.warning("Unable to save solar data cache", error=e)
+
+
+def get(lat, lng, day):
+    # returns the (sunrise, sunset) tuple (UTC, 24 hour format) for the location and day
+    # or None if it isn't in the cache
+    if _cache is None:
+        load()
+    times = _cache.get(_location_key(lat, lng), {}).get(day.isoformat())
+    if times is None:
+        return None
+    return times[0], times[1]
+
+
+def put(lat, lng, day, sunrise, sunset):
+    # add the location's sunrise and sunset (UTC, 24 hour format) for the day to the cache
+    if _cache is None:
+        load()
+    _cache.setdefault(_location_key(lat, lng), {})[day.isoformat()] = [int(sunrise), int(sunset)]
+
+
+def evict(today):
+    # remove any entries more than MAX_AGE_DAYS days before today, returns how many were removed
+    if _cache is None:
+        load()
+    oldest = (today - timedelta(days=MAX_AGE_DAYS)).isoformat()
+    removed = 0
+    for location in list(_cache):
+        days = _cache[location]
+        for day in [day for day in days if day < oldest]:
+            del days[day]
+            removed += 1
+        if not days:
+            del _cache[location]
+    return removed
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Solar Calculator
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Calculates sunrise and sunset times locally (no network required) using the NOAA general solar position
+#    equations: https://gml.noaa.gov/grad/solcalc/solareqns.PDF. The calculations are done with NumPy, so an
+#    entire year's worth of sunrise and sunset times is calculated in one shot. Results are accurate to within
+#    a couple of minutes, which is plenty for turning lights on and off.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import minutes
+import tz_table
+
+# The zenith angle (in degrees) of the sun at sunrise and sunset. It's a little more than 90
+# to account for atmospheric refraction and the size of the sun's disc
+SUN_ZENITH = 90.833
+
+# The years' worth of results calculated lately, so we don't have to calculate them every day
+# key: (lat, long, year, timezone), value: (sunrise array, sunset array). It holds up to
+# YEAR_CACHE_SIZE of them (fleet.py asks for one per location), the least recently used one goes first
+YEAR_CACHE_SIZE = 16
+_year_cache = {}
+
+# Published sunrise and sunset times (24 hour format, local time) for the 2026 solstices, the
+# calculated times have to be within REFERENCE_TOLERANCE minutes of them (run this file to check)
+REFERENCE_TOLERANCE = 2
+REFERENCE_TIMES = [
+    # (place, lat, long, timezone, day, sunrise, sunset)
+    ("London", 51.5074, -0.1278, "Europe/London", date(2026, 6, 21), 443, 2121),
+    ("London", 51.5074, -0.1278, "Europe/London", date(2026, 12, 21), 804, 1553),
+    ("New York", 40.7128, -74.0060, "America/New_York", date(2026, 6, 21), 525, 2031),
+    ("New York", 40.7128, -74.0060, "America/New_York", date(2026, 12, 21), 716, 1632),
+    ("Sydney", -33.8688, 151.2093, "Australia/Sydney", date(2026, 6, 21), 700, 1654),
+    ("Sydney", -33.8688, 151.2093, "Australia/Sydney", date(2026, 12, 21), 541, 2005),
+    # the sun sets just after midnight
+    ("Reykjavik", 64.1466, -21.9426, "Atlantic/Reykjavik", date(2026, 6, 21), 255, 3),
+    ("Reykjavik", 64.1466, -21.9426, "Atlantic/Reykjavik", date(2026, 12, 21), 1122, 1530),
+]
+# a place where the sun doesn't set in June or rise in December
+POLAR_REFERENCE = ("Tromso", 69.6492, 18.9553, "Europe/Oslo")
+
+
+def solar_minutes_utc(lat, lng, day_of_year, days_in_year=365):
+    # returns arrays of sunrise and sunset times (in minutes after midnight UTC) for each of the
+    # days (1 = January 1st) in day_of_year. lat and lng are in degrees, with north and east positive
+    doy = np.asarray(day_of_year, dtype=float)
+    # fractional year (in radians), calculated for noon
+    gamma = 2 * np.pi / days_in_year * (doy - 1)
+    # equation of time (in minutes)
+    eq_time = 229.18 * (0.000075 + 0.001868 * np.cos(gamma) - 0.032077 * np.sin(gamma) -
+                        0.014615 * np.cos(2 * gamma) - 0.040849 * np.sin(2 * gamma))
+    # solar declination angle (in radians)
+    decl = (0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma) - 0.006758 * np.cos(2 * gamma) +
+            0.000907 * np.sin(2 * gamma) - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+    # hour angle (in degrees) of sunrise, sunset is the same angle on the other side of noon
+    lat_rad = np.radians(lat)
+    cos_ha = np.cos(np.radians(SUN_ZENITH)) / (np.cos(lat_rad) * np.cos(decl)) - np.tan(lat_rad) * np.tan(decl)
+    # above the arctic circle the sun may not rise (or set) at all; clipping puts sunrise and sunset
+    # a minute (0.25 degrees) either side of noon (no daylight) or of midnight (all daylight), so
+    # they're never the same time: a sunrise to sunset slot is two minutes long during the polar
+    # night and runs all day (but two minutes) during the polar day, a sunset to sunrise one the
+    # other way around
+    ha = np.clip(np.degrees(np.arccos(np.clip(cos_ha, -1, 1))), 0.25, 179.75)
+    sunrise = 720 - 4 * (lng + ha) - eq_time
+    sunset = 720 - 4 * (lng - ha) - eq_time
+    return sunrise, sunset
+
+
+def minutes_to_time_24(minutes):
+    # converts an array of minutes after midnight to 24 hour format (HHMM, like the slots use)
+    mins = np.mod(np.rint(minutes).astype(int), 1440)
+    return (mins // 60) * 100 + mins % 60
+
+
+def get_year_times(lat, lng, year, tz=None):
+    # returns arrays of sunrise and sunset times (24 hour format, local time) for every day of
+    # the year; index 0 is January 1st
+    table = tz_table.get_table(year, tz)
+    first_day = date(year, 1, 1)
+    num_days = (date(year + 1, 1, 1) - first_day).days
+    sunrise, sunset = solar_minutes_utc(lat, lng, np.arange(1, num_days + 1), num_days)
+    # the local timezone offset (in minutes) for each day, taken at noon
+    offsets = np.array([table.utc_offset(table.to_timestamp(datetime(year, 1, 1, 12) + timedelta(days=i))) / 60
+                        for i in range(num_days)])
+    return minutes_to_time_24(sunrise + offsets), minutes_to_time_24(sunset + offsets)
+
+
+def get_solar_times(lat, lng, day=None, tz=None):
+    # returns a tuple with the sunrise and sunset times (24 hour format, local time) for the day
+    # (a date, defaults to today). The whole year gets calculated the first time through
+    if day is None:
+        day = date.today()
+    tz = tz or tz_table.get_zone()
+    key = (lat, lng, day.year, tz)
+    times = _year_cache.pop(key, None)
+    if times is None:
+        times = get_year_times(lat, lng, day.year, tz)
+        if len(_year_cache) >= YEAR_CACHE_SIZE:
+            del _year_cache[next(iter(_year_cache))]
+    # (put back at the end, the most recently used)
+    _year_cache[key] = times
+    sunrise, sunset = times
+    index = day.timetuple().tm_yday - 1
+    return int(sunrise[index]), int(sunset[index])
+
+
+def check_reference():
+    # compare the calculated times with REFERENCE_TIMES (and make sure the polar day and night
+    # work), raises AssertionError if any of them are off
+    from zoneinfo import ZoneInfo
+
+    failures = []
+    for place, lat, lng, zone, day, sunrise, sunset in REFERENCE_TIMES:
+        calculated = get_solar_times(lat, lng, day, ZoneInfo(zone))
+        # how far off each time is, either way around midnight
+        errors = [min(minutes.length(minutes.from_time_24(expected), minutes.from_time_24(actual)),
+                      minutes.length(minutes.from_time_24(actual), minutes.from_time_24(expected)))
+                  for expected, actual in zip((sunrise, sunset), calculated)]
+        print("%-10s %s  sunrise %04d (published %04d)  sunset %04d (published %04d)" % (
+            place, day, calculated[0], sunrise, calculated[1], sunset))
+        if max(errors) > REFERENCE_TOLERANCE:
+            failures.append("%s %s: calculated %s, published %s" % (place, day, calculated, (sunrise, sunset)))
+    place, lat, lng, zone = POLAR_REFERENCE
+    for day, shortest, longest in ((date(2026, 6, 21), minutes.MINUTES_PER_DAY - 2, minutes.MINUTES_PER_DAY - 1),
+                                   (date(2026, 12, 21), 1, 2)):
+        sunrise, sunset = get_solar_times(lat, lng, day, ZoneInfo(zone))
+        daylight = minutes.length(minutes.from_time_24(sunrise), minutes.from_time_24(sunset))
+        print("%-10s %s  sunrise %04d  sunset %04d  (%d minutes of daylight)" % (place, day, sunrise, sunset,
+                                                                                 daylight))
+        if not shortest <= daylight <= longest:
+            failures.append("%s %s: %d minutes of daylight" % (place, day, daylight))
+    # the same place and year in another timezone gets its own times, and the first ones stay cached
+    place, lat, lng, zone, day, sunrise, sunset = REFERENCE_TIMES[0]
+    elsewhere = get_solar_times(lat, lng, day, ZoneInfo("America/New_York"))
+    if elsewhere == get_solar_times(lat, lng, day, ZoneInfo(zone)):
+        failures.append("%s's times didn't change with the timezone" % place)
+    if (lat, lng, day.year, ZoneInfo(zone)) not in _year_cache:
+        failures.append("%s's times were dropped from the cache" % place)
+    if failures:
+        raise AssertionError("Solar times are off:\n" + "\n".join(failures))
+    print("All of the solar times are within %d minutes" % REFERENCE_TOLERANCE)
+
+
+if __name__ == "__main__":
+    # Calculate a year's worth of solar times for Charlotte, NC and see how long it takes,
+    # then check the results against the published times
+    try:
+        loc_lat = 35.227085
+        loc_long = -80.843124
+        iterations = 100
+        start = time.time()
+        for i in range(iterations):
+            get_year_times(loc_lat, loc_long, 2026)
+        elapsed = (time.time() - start) / iterations
+        print("Calculated a year of sunrise/sunset times in %.2f ms" % (elapsed * 1000))
+        print("Today's sunrise and sunset:", get_solar_times(loc_lat, loc_long))
+        check_reference()
+    except KeyboardInterrupt:
+        print("\nExiting application\n")
+        sys.exit(0)
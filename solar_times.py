@@ -7,9 +7,11 @@ import sys
 from datetime import datetime
 
 import pytz
-import requests
 import tzlocal
 
+import solar_api
+import solar_calc
+
 # API for determining sunrise and sunset times; details at http://sunrise-sunset.org/api
 # Test URL to retrieve data for Charlotte, NC US:
 # http://api.sunrise-sunset.org/json?lat=35.2271&lng=-80.8431&date=today
@@ -29,24 +31,22 @@ def get_solar_times():
     format_str = "%I:%M:%S %p"
 
     print("\nRequesting solar data from", SOLAR_API_URL)
-    payload = {"lat": LOC_LAT, "lng": LOC_LONG, "date": "today"}
+    # solar_api makes the request (with its shared session, timeout and retries), so a
+    # slow or hung server can't hold this up for long
+    results = solar_api.fetch(LOC_LAT, LOC_LONG, "today", SOLAR_API_URL)
+    # did we get a result?
+    if results is None:
+        print("Unable to obtain solar data")
+        return
     try:
-        res = requests.get(SOLAR_API_URL, params=payload)
-        # did we get a result?
-        if res.status_code == requests.codes.ok:
-            data = res.json()
-            # time comes in as a string, in UTC time, but with no timezone data.
-            # it must be converted into a format we can use...
-            time_sunrise = adjust_time_utc(datetime.strptime(data['results']['sunrise'], format_str))
-            print("Sunrise:", str(time_sunrise))
-            time_sunset = adjust_time_utc(datetime.strptime(data['results']['sunset'], format_str))
-            print("Sunset:", str(time_sunset))
-        else:
-            print("Unable to obtain solar data; server returned", res.status_code)
-    except ValueError as e:
+        # time comes in as a string, in UTC time, but with no timezone data.
+        # it must be converted into a format we can use...
+        time_sunrise = adjust_time_utc(datetime.strptime(results['sunrise'], format_str))
+        print("Sunrise:", str(time_sunrise))
+        time_sunset = adjust_time_utc(datetime.strptime(results['sunset'], format_str))
+        print("Sunset:", str(time_sunset))
+    except (ValueError, KeyError, TypeError) as e:
         print("Value Error:", e)
-    except Exception as e:
-        print("Unexpected error:", e)
 
 
 def adjust_time_utc(time_val):
@@ -84,6 +84,8 @@ if __name__ == "__main__":
     try:
         print(get_time_24(23))
         get_solar_times()
+        # compare the web service's results with the ones calculated locally
+        print("\nCalculated locally:", solar_calc.get_solar_times(float(LOC_LAT), float(LOC_LONG)))
     except KeyboardInterrupt:
         print("\nExiting application\n")
         # exit the application
@@ -0,0 +1,241 @@
+#!/usr/bin/python
+# *****************************************************************************************************************
+#    Pi Power Controller - Timezone Table
+#    By John M. Wargo
+#    www.johnwargo.com
+#
+#    Converts between UTC and local time. The local timezone is looked up once, then a table of its UTC offsets
+#    (and the moments they change, the daylight saving time transitions) is built for each year, so every
+#    conversion after that is a quick lookup in a short list.
+#
+#    On the day daylight saving time starts, the local times in the skipped hour (2:00 to 2:59 AM in the US)
+#    never happen; to_utc returns the moment the clock jumps (3:00 AM) for them. On the day it ends, the local
+#    times in the repeated hour happen twice; to_utc returns the first one, and schedule_time (the local time the
+#    schedule goes by) stays at the end of the first one until the clock catches up, so the schedule only runs
+#    them once. Run this file to check all of that (it fails loudly if anything's wrong) and see it in action.
+# ********************************************************************************************************************
+
+from __future__ import print_function
+
+import sys
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+import clock
+
+# the start of (naive) time, used to turn naive local times into seconds
+EPOCH = datetime(1970, 1, 1)
+# how often (in seconds) the table builder checks for an offset change
+STEP = 6 * 60 * 60
+
+# what the conversions around New York's 2026 daylight saving time changes are supposed to give,
+# (naive local time, naive UTC time). Run this file to check them
+NEW_YORK_CHECKS = [
+    # the clock jumps from 2:00 to 3:00 AM (EST to EDT) on March 8th, 7:00 AM UTC
+    (datetime(2026, 3, 8, 1, 59), datetime(2026, 3, 8, 6, 59)),
+    (datetime(2026, 3, 8, 2, 0), datetime(2026, 3, 8, 7, 0)),
+    (datetime(2026, 3, 8, 2, 30), datetime(2026, 3, 8, 7, 0)),
+    (datetime(2026, 3, 8, 3, 0), datetime(2026, 3, 8, 7, 0)),
+    # 1:00 to 1:59 AM happens twice on November 1st (EDT, then EST), the first one counts
+    (datetime(2026, 11, 1, 0, 59), datetime(2026, 11, 1, 4, 59)),
+    (datetime(2026, 11, 1, 1, 30), datetime(2026, 11, 1, 5, 30)),
+    (datetime(2026, 11, 1, 2, 0), datetime(2026, 11, 1, 7, 0)),
+]
+
+# the system's timezone, looked up the first time it's needed
+_zone = None
+# (zone, year): table
+_tables = {}
+
+
+def get_zone():
+    # returns the local timezone (a tzinfo object): the virtual clock's, if there is one,
+    # otherwise the system's
+    global _zone
+
+    zone = clock.zone()
+    if zone is not None:
+        return zone
+    if _zone is None:
+        try:
+            import tzlocal
+            _zone = tzlocal.get_localzone()
+        except ImportError:
+            # no tzlocal, so all we know is the system's current UTC offset
+            _zone = datetime.now(clock.utc).astimezone().tzinfo
+    return _zone
+
+
+def _offset(zone, timestamp):
+    # the zone's UTC offset (in seconds) at the (UTC) timestamp, the slow way
+    return int(datetime.fromtimestamp(timestamp, zone).utcoffset().total_seconds())
+
+
+class ZoneTable(object):
+    # A timezone's UTC offsets for a year (plus a couple of days on either side). starts holds the
+    # (UTC) timestamps where each offset starts, offsets holds the offsets (in seconds)
+
+    def __init__(self, zone, year):
+        self.zone = zone
+        self.year = year
+        start = int((datetime(year, 1, 1) - EPOCH).total_seconds()) - 2 * 86400
+        end = int((datetime(year + 1, 1, 1) - EPOCH).total_seconds()) + 2 * 86400
+        self.starts = [start]
+        self.offsets = [_offset(zone, start)]
+        timestamp = start
+        while timestamp < end:
+            offset = _offset(zone, timestamp + STEP)
+            if offset != self.offsets[-1]:
+                # the offset changed, find the exact second it changed
+                low, high = timestamp, timestamp + STEP
+                while high - low > 1:
+                    middle = (low + high) // 2
+                    if _offset(zone, middle) == self.offsets[-1]:
+                        low = middle
+                    else:
+                        high = middle
+                self.starts.append(high)
+                self.offsets.append(offset)
+            timestamp += STEP
+
+    def _segment(self, timestamp):
+        return max(bisect_right(self.starts, timestamp) - 1, 0)
+
+    def utc_offset(self, timestamp):
+        # returns the UTC offset (in seconds) at the (UTC) timestamp
+        return self.offsets[self._segment(timestamp)]
+
+    def transitions(self):
+        # returns the list of (timestamp, old offset, new offset) for each offset change
+        return [(self.starts[i], self.offsets[i - 1], self.offsets[i]) for i in range(1, len(self.starts))]
+
+    def to_local(self, timestamp):
+        # returns the naive local time for the (UTC) timestamp
+        return EPOCH + timedelta(seconds=timestamp + self.utc_offset(timestamp))
+
+    def schedule_time(self, timestamp):
+        # returns the naive local time the schedule goes by at the (UTC) timestamp: the local time,
+        # except during the second pass through a repeated hour, where it's the last second of the
+        # first pass (the schedule already ran that hour)
+        segment = self._segment(timestamp)
+        if segment > 0:
+            repeated = self.offsets[segment - 1] - self.offsets[segment]
+            if 0 < repeated and timestamp < self.starts[segment] + repeated:
+                return EPOCH + timedelta(seconds=self.starts[segment] + self.offsets[segment - 1] - 1)
+        return self.to_local(timestamp)
+
+    def to_timestamp(self, local_time):
+        # returns the (UTC) timestamp for the naive local time. Skipped local times return the
+        # moment the clock jumped, repeated ones return their first occurrence
+        local_seconds = (local_time - EPOCH).total_seconds()
+        segment = self._segment(local_seconds - self.offsets[self._segment(local_seconds)])
+        for index in range(max(segment - 1, 0), min(segment + 2, len(self.starts))):
+            timestamp = local_seconds - self.offsets[index]
+            if timestamp < self.starts[index] and index > 0:
+                # it's before this offset started, was it in a gap (skipped)?
+                if local_seconds - self.offsets[index - 1] >= self.starts[index]:
+                    return self.starts[index]
+                continue
+            if index + 1 < len(self.starts) and timestamp >= self.starts[index + 1]:
+                continue
+            # the earliest valid one wins
+            return timestamp
+        return local_seconds - self.offsets[segment]
+
+
+def get_table(year, zone=None):
+    # returns the (cached) table for the zone (the local timezone by default) and year
+    zone = zone or get_zone()
+    key = (zone, year)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = ZoneTable(zone, year)
+    return table
+
+
+def _timestamp(utc_time):
+    # naive times are assumed to be UTC
+    if utc_time.tzinfo is None:
+        return (utc_time - EPOCH).total_seconds()
+    return utc_time.timestamp()
+
+
+def to_local(utc_time):
+    # returns the naive local time for the UTC time
+    return get_table(utc_time.year).to_local(_timestamp(utc_time))
+
+
+def to_utc(local_time):
+    # returns the (aware) UTC time for the naive local time. Local times skipped by a daylight saving
+    # time change return the moment the clock jumped, repeated ones return their first occurrence
+    timestamp = get_table(local_time.year).to_timestamp(local_time)
+    return datetime.fromtimestamp(timestamp, clock.utc)
+
+
+def schedule_time(utc_time):
+    # returns the naive local time the schedule goes by at the UTC time. It's the local time, except
+    # that the repeated hour (when daylight saving time ends) only happens once: the second time through
+    # it, this stays at the end of the first time through it
+    return get_table(utc_time.year).schedule_time(_timestamp(utc_time))
+
+
+def utc_offset(utc_time):
+    # returns the local timezone's UTC offset (a timedelta) at the UTC time
+    return timedelta(seconds=get_table(utc_time.year).utc_offset(_timestamp(utc_time)))
+
+
+def check():
+    # check the conversions in NEW_YORK_CHECKS (both ways), raises AssertionError if any are wrong
+    from zoneinfo import ZoneInfo
+
+    table = ZoneTable(ZoneInfo("America/New_York"), 2026)
+    failures = []
+    if [(datetime.fromtimestamp(timestamp, clock.utc).replace(tzinfo=None), old, new)
+            for timestamp, old, new in table.transitions()] != [(datetime(2026, 3, 8, 7), -18000, -14400),
+                                                                 (datetime(2026, 11, 1, 6), -14400, -18000)]:
+        failures.append("wrong transitions: %s" % table.transitions())
+    for local_time, utc_time in NEW_YORK_CHECKS:
+        timestamp = (utc_time - EPOCH).total_seconds()
+        if table.to_timestamp(local_time) != timestamp:
+            failures.append("%s local should be %s UTC, not %s" % (
+                local_time, utc_time, EPOCH + timedelta(seconds=table.to_timestamp(local_time))))
+    # and back again: the second 1:30 AM is an hour after the first, but the schedule doesn't run it again
+    for utc_time, local_time, schedule_time in (
+            (datetime(2026, 3, 8, 7, 0), datetime(2026, 3, 8, 3, 0), datetime(2026, 3, 8, 3, 0)),
+            (datetime(2026, 11, 1, 5, 30), datetime(2026, 11, 1, 1, 30), datetime(2026, 11, 1, 1, 30)),
+            (datetime(2026, 11, 1, 6, 0), datetime(2026, 11, 1, 1, 0), datetime(2026, 11, 1, 1, 59, 59)),
+            (datetime(2026, 11, 1, 6, 30), datetime(2026, 11, 1, 1, 30), datetime(2026, 11, 1, 1, 59, 59)),
+            (datetime(2026, 11, 1, 7, 0), datetime(2026, 11, 1, 2, 0), datetime(2026, 11, 1, 2, 0))):
+        timestamp = (utc_time - EPOCH).total_seconds()
+        if table.to_local(timestamp) != local_time:
+            failures.append("%s UTC should be %s local" % (utc_time, local_time))
+        if table.schedule_time(timestamp) != schedule_time:
+            failures.append("%s UTC should be %s on the schedule" % (utc_time, schedule_time))
+    if failures:
+        raise AssertionError("Timezone conversions are wrong:\n" + "\n".join(failures))
+    print("New York's daylight saving time changes are handled correctly")
+
+
+if __name__ == "__main__":
+    # check the daylight saving time changes are handled correctly, then show how they're handled
+    # (in New York, or the timezone you pass in)
+    try:
+        from zoneinfo import ZoneInfo
+
+        check()
+        zone = ZoneInfo(sys.argv[1] if len(sys.argv) > 1 else "America/New_York")
+        clock.set_clock(datetime.now, clock.monotonic, zone=zone)
+        table = get_table(2026)
+        for timestamp, old, new in table.transitions():
+            print("\nUTC offset changes from %+.1f to %+.1f hours at %s UTC" % (
+                old / 3600.0, new / 3600.0, datetime.fromtimestamp(timestamp, clock.utc).replace(tzinfo=None)))
+            # the local time the change happens at (by the old offset), and some times around it
+            changed_at = EPOCH + timedelta(seconds=timestamp + old)
+            for minutes in (-90, -30, 0, 30, 90):
+                local_time = changed_at + timedelta(minutes=minutes)
+                utc_time = to_utc(local_time)
+                print("%s local -> %s UTC -> %s local" % (
+                    local_time, utc_time.replace(tzinfo=None), to_local(utc_time)))
+    except KeyboardInterrupt:
+        print("\nExiting application\n")
+        sys.exit(0)